@@ -0,0 +1,279 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+# headless: the GUI benchmarks drive a real LabelingTool without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from benchmarks.synthetic_workspace import make_workspace  # noqa: E402
+
+# git-ignored, runs are compared locally and never committed
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def summarize(seconds):
+    """Timing summary in milliseconds of a list of durations in seconds."""
+    ms = np.array(seconds) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_init_db(workspace_path, repeat):
+    from init_db import init_db
+    from modules.database import LabelDatabase
+
+    db_path = os.path.join(workspace_path, "labels.db")
+    backup_path = db_path + ".bench"
+    shutil.copyfile(db_path, backup_path)
+    seconds = []
+    try:
+        for _ in range(repeat):
+            LabelDatabase.remove(db_path)
+            seconds.append(timed(init_db, workspace_path))
+    finally:
+        LabelDatabase.remove(db_path)
+        os.replace(backup_path, db_path)
+    return {"init_db": summarize(seconds)}
+
+
+def bench_gui(workspace_path, repeat, new_images):
+    from PySide6.QtCore import QEvent, Qt
+    from PySide6.QtGui import QKeyEvent
+    from PySide6.QtWidgets import QApplication, QFileDialog, QMessageBox
+
+    import main
+
+    def fail(parent, title, text, *args):
+        raise RuntimeError(text)
+
+    app = QApplication.instance() or QApplication([])
+    QFileDialog.getExistingDirectory = staticmethod(lambda *args: workspace_path)
+    QMessageBox.warning = staticmethod(fail)
+
+    results = {}
+    # a placeholder segmenter keeps torch out of the GUI timings
+    window = main.LabelingTool(segmenter=object())
+    try:
+        results["open_directory"] = summarize([timed(window.open_directory)])
+
+        results["update_database"] = summarize(
+            [timed(window.update_database, workspace_path) for _ in range(repeat)]
+        )
+
+        # images copied into the workspace, as the watcher would report them
+        source = window.image_paths[0]
+        added = []
+        for index in range(new_images):
+            path = os.path.join(workspace_path, f"zz_added_{index:05d}.jpg")
+            shutil.copyfile(source, path)
+            added.append(path)
+        window.on_workspace_changed("raw", added, [])
+        results["update_database_added"] = summarize(
+            [timed(window.update_database, workspace_path)]
+        )
+        for path in added:
+            os.remove(path)
+        window.on_workspace_changed("raw", [], added)
+        window.update_database(workspace_path)
+
+        if not window.label_index.label_keys:
+            # a workspace generated with --labels 0 has no key to press
+            skipped = {"skipped": "workspace has no labels"}
+            for name in (
+                "label_keystroke",
+                "label_current_image",
+                "update_cur_image_labels_display",
+            ):
+                results[name] = skipped
+            return results
+        key = next(iter(window.label_index.label_keys))
+        keystrokes = []
+        for _ in range(repeat):
+            event = QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_A, Qt.NoModifier, key)
+            keystrokes.append(timed(window.keyPressEvent, event))
+            app.processEvents()
+        results["label_keystroke"] = summarize(keystrokes)
+
+        results["label_current_image"] = summarize(
+            [timed(window.label_current_image, key) for _ in range(repeat)]
+        )
+        results["update_cur_image_labels_display"] = summarize(
+            [timed(window.update_cur_image_labels_display) for _ in range(repeat)]
+        )
+    finally:
+        window.close()
+        app.processEvents()
+    return results
+
+
+def bench_blobs(workspace_path, repeat):
+    from modules.blob_detector import BlobDetector
+    from modules.workspace import existing_mask_path, get_image_paths
+
+    mask_folder = os.path.join(workspace_path, "segmented_images", "masks")
+    image_paths = get_image_paths(workspace_path)[:repeat]
+    detector = BlobDetector()
+    detect_seconds = []
+    draw_seconds = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for image_path in image_paths:
+            start = time.perf_counter()
+            keypoints = detector.detect_blobs(image_path)
+            detect_seconds.append(time.perf_counter() - start)
+            draw_seconds.append(
+                timed(
+                    detector.draw_blobs,
+                    image_path,
+                    existing_mask_path(mask_folder, image_path),
+                    keypoints,
+                    os.path.join(output_dir, "blobs.png"),
+                    os.path.join(output_dir, "keypoints.json"),
+                )
+            )
+    return {
+        "detect_blobs": summarize(detect_seconds),
+        "draw_blobs": summarize(draw_seconds),
+    }
+
+
+def bench_segmentation(workspace_path, repeat):
+    from modules.workspace import get_image_paths
+
+    try:
+        from modules.face_segementation import FaceSegmentation
+
+        # the cache would turn every run after the first into a file copy, and
+        # the CPU keeps the timings comparable between machines with and
+        # without a GPU
+        segmenter = FaceSegmentation(cache=False, device="cpu")
+    except Exception as e:
+        return {"segment_face": {"skipped": f"model unavailable: {e}"}}
+    image_paths = get_image_paths(workspace_path)[:repeat]
+    with tempfile.TemporaryDirectory() as output_dir:
+        seconds = [
+            timed(
+                segmenter.segment_face,
+                image_path,
+                os.path.join(output_dir, "segmented.png"),
+                os.path.join(output_dir, "mask.png"),
+            )
+            for image_path in image_paths
+        ]
+    return {"segment_face": summarize(seconds)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the main code paths on a synthetic workspace."
+    )
+    parser.add_argument("--images", type=int, default=500, help="workspace size")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--labels", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20, help="samples per timing")
+    parser.add_argument(
+        "--new-images", type=int, default=50, help="images added before a db update"
+    )
+    parser.add_argument(
+        "--skip-segmentation",
+        action="store_true",
+        help="do not load the segmentation model",
+    )
+    parser.add_argument(
+        "--workspace",
+        type=os.path.abspath,
+        help="reuse or keep the generated workspace in this folder",
+    )
+    parser.add_argument("--output", help="results file (default: benchmarks/results)")
+    args = parser.parse_args()
+
+    workspace_path = args.workspace or tempfile.mkdtemp(prefix="bench-workspace-")
+    try:
+        start = time.perf_counter()
+        make_workspace(
+            workspace_path,
+            images=args.images,
+            width=args.width,
+            height=args.height,
+            labels=args.labels,
+            seed=args.seed,
+        )
+        results = {"make_workspace": summarize([time.perf_counter() - start])}
+        results.update(bench_init_db(workspace_path, args.repeat))
+        results.update(bench_gui(workspace_path, args.repeat, args.new_images))
+        results.update(bench_blobs(workspace_path, args.repeat))
+        if not args.skip_segmentation:
+            results.update(bench_segmentation(workspace_path, min(args.repeat, 5)))
+    finally:
+        if not args.workspace:
+            shutil.rmtree(workspace_path, ignore_errors=True)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    commit = git_commit()
+    report = {
+        "timestamp": now.isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("workspace", "output")
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{now:%Y%m%dT%H%M%SZ}-{commit or 'unknown'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, summary in results.items():
+        if "skipped" in summary:
+            print(f"{name:34} skipped ({summary['skipped']})")
+        else:
+            print(
+                f"{name:34} p50 {summary['p50_ms']:9.2f} ms  "
+                f"p95 {summary['p95_ms']:9.2f} ms  (n={summary['n']})"
+            )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import sqlite3
+
+import cv2
+import numpy as np
+
+from init_db import init_db
+from modules.blob_detector import FACE_PARSING_LABELS
+from modules.mask_io import save_mask
+from modules.workspace import (
+    segmentation_folders,
+    segmentation_output_paths,
+)
+
+
+def synthetic_face(rng, width, height, blob_count):
+    """Return (BGR image, uint8 mask) of a face-like ellipse with dark blobs."""
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = (200, 210, 225)
+    mask = np.zeros((height, width), np.uint8)
+    center = (width // 2, height // 2)
+    axes = (width // 3, height * 2 // 5)
+    skin = FACE_PARSING_LABELS.index("skin")
+    nose = FACE_PARSING_LABELS.index("nose")
+    cv2.ellipse(image, center, axes, 0, 0, 360, (150, 170, 205), -1)
+    cv2.ellipse(mask, center, axes, 0, 0, 360, skin, -1)
+    nose_axes = (width // 20, height // 10)
+    cv2.ellipse(image, center, nose_axes, 0, 0, 360, (140, 160, 200), -1)
+    cv2.ellipse(mask, center, nose_axes, 0, 0, 360, nose, -1)
+    for _ in range(blob_count):
+        radius = int(rng.integers(6, 20))
+        x = int(rng.integers(center[0] - axes[0] // 2, center[0] + axes[0] // 2))
+        y = int(rng.integers(center[1] - axes[1] // 2, center[1] + axes[1] // 2))
+        shade = int(rng.integers(20, 90))
+        cv2.circle(image, (x, y), radius, (shade, shade, shade + 10), -1)
+    noise = rng.normal(0, 3, image.shape)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+    return image, mask
+
+
+def make_workspace(
+    workspace_path,
+    images=100,
+    width=1024,
+    height=768,
+    labels=5,
+    labels_per_image=1.0,
+    blobs_per_image=20,
+    with_masks=True,
+    seed=0,
+):
+    """Generate a reproducible workspace: images, masks and a labels.db.
+
+    Every image gets a segmented image and mask when with_masks is set, and
+    on average labels_per_image image_labels rows. The same arguments always
+    produce the same files.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(workspace_path, exist_ok=True)
+    seg_folder, mask_folder = segmentation_folders(workspace_path)
+    for index in range(images):
+        image, mask = synthetic_face(rng, width, height, blobs_per_image)
+        image_path = os.path.join(workspace_path, f"face_{index:05d}.jpg")
+        cv2.imwrite(image_path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if with_masks:
+            seg_image_path, mask_path = segmentation_output_paths(
+                seg_folder, mask_folder, image_path
+            )
+            cv2.imwrite(seg_image_path, cv2.applyColorMap(mask * 13, cv2.COLORMAP_JET))
+            save_mask(mask_path, mask)
+
+    db_path = os.path.join(workspace_path, "labels.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    init_db(workspace_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO labels (label_name, key_binding) VALUES (?, ?)",
+            ((f"label_{i}", chr(ord("A") + i)) for i in range(labels)),
+        )
+        image_ids = [row[0] for row in conn.execute("SELECT id FROM images")]
+        label_ids = [row[0] for row in conn.execute("SELECT id FROM labels")]
+        pairs = set()
+        picker = random.Random(seed)
+        # with labels=0 there is nothing to assign
+        for _ in range(int(len(image_ids) * labels_per_image) if label_ids else 0):
+            pairs.add((picker.choice(image_ids), picker.choice(label_ids)))
+        conn.executemany(
+            "INSERT INTO image_labels (image_id, label_id) VALUES (?, ?)", sorted(pairs)
+        )
+    conn.close()
+    return workspace_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic workspace for benchmarks."
+    )
+    parser.add_argument("workspace", type=os.path.abspath, help="directory to create")
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--labels", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_workspace(
+        args.workspace,
+        images=args.images,
+        width=args.width,
+        height=args.height,
+        labels=args.labels,
+        seed=args.seed,
+    )
@@ -1,74 +1,110 @@
+import argparse
+import json
 import sqlite3
-import glob
 import os
-from natsort import natsorted
+
+from modules.database import LabelDatabase
+from modules.schema import SCHEMA_VERSION, migrate, schema_version
+from modules.workspace import blob_output_paths, get_image_paths, iter_image_paths
 
 
 def init_db(workspace_path):
+    # labels.db stores absolute image paths, the GUI matches them as such
+    workspace_path = os.path.abspath(workspace_path)
     db_path = os.path.join(workspace_path, "labels.db")
     conn = sqlite3.connect(database=db_path)
     c = conn.cursor()
 
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS labels (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        label_name TEXT NOT NULL,
-        key_binding TEXT NOT NULL
-    )
-    """
-    )
-
-    # given the path to a directory, this will return a list of all image files in that directory
-    # sorted in natural order
-    def get_image_paths(directory):
-        return natsorted(
-            glob.glob(os.path.join(directory, "*.jpg"))
-            + glob.glob(os.path.join(directory, "*.png"))
-        )
+    # create every table at the current schema version, see modules/schema.py
+    migrate(conn)
 
     images = get_image_paths(workspace_path)
 
-    # c.execute(
-    #     """
-    # CREATE TABLE IF NOT EXISTS image_labels (
-    #     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    #     image_path TEXT NOT NULL,
-    #     label_id INTEGER NOT NULL,
-    #     FOREIGN KEY(label_id) REFERENCES labels(id)
-    # )
-    # """
-    # )
-    # Create a table for images
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        image_path TEXT NOT NULL UNIQUE
-    )
-    """
-    )
-
-    # Create a junction table for image-label relationships
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS image_labels (
-        image_id INTEGER,
-        label_id INTEGER,
-        PRIMARY KEY (image_id, label_id),
-        FOREIGN KEY (image_id) REFERENCES images(id),
-        FOREIGN KEY (label_id) REFERENCES labels(id)
-    )
-    """
-    )
-
     # Insert all images into the database
-    for image in images:
-        c.execute("INSERT INTO images (image_path) VALUES (?)", (image,))
+    c.executemany(
+        "INSERT INTO images (image_path) VALUES (?)", ((image,) for image in images)
+    )
 
     conn.commit()
     conn.close()
 
 
+def sync_db(workspace_path):
+    """Bring an existing database in line with the images in the workspace."""
+    workspace_path = os.path.abspath(workspace_path)
+    db = LabelDatabase(os.path.join(workspace_path, "labels.db"))
+    try:
+        return db.sync_images(iter_image_paths(workspace_path))
+    finally:
+        db.close()
+
+
+def migrate_db(workspace_path):
+    """Upgrade the labels.db of a workspace to the current schema version."""
+    conn = sqlite3.connect(os.path.join(workspace_path, "labels.db"))
+    try:
+        return migrate(conn), schema_version(conn)
+    finally:
+        conn.close()
+
+
+def import_blobs(workspace_path):
+    """Load the keypoints/*_keypoints.json files of a workspace into labels.db."""
+    blob_folder = os.path.join(workspace_path, "blob_images")
+    keypoints_folder = os.path.join(blob_folder, "keypoints")
+    db = LabelDatabase(os.path.join(workspace_path, "labels.db"))
+
+    def image_blobs():
+        for image_path, image_id in db.image_ids():
+            keypoints_path = blob_output_paths(
+                blob_folder, keypoints_folder, image_path
+            )[1]
+            if os.path.exists(keypoints_path):
+                with open(keypoints_path) as f:
+                    yield image_id, json.load(f)
+
+    try:
+        return db.replace_blobs(image_blobs())
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
-    init_db()
+    parser = argparse.ArgumentParser(
+        description="Create or update the labels database of a workspace."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing the raw images"
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="update an existing database instead of creating a new one",
+    )
+    parser.add_argument(
+        "--import-blobs",
+        action="store_true",
+        help="load the blob keypoints json files into an existing database",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="upgrade an existing database to the current schema version",
+    )
+    args = parser.parse_args()
+    if args.migrate:
+        applied, version = migrate_db(args.workspace)
+        print(
+            f"Applied migrations {applied or 'none'}, "
+            f"schema version {version} of {SCHEMA_VERSION}"
+        )
+    elif args.sync:
+        stats = sync_db(args.workspace)
+        print(
+            f"Added {stats['added']} images, removed {stats['removed']} images and "
+            f"{stats['orphaned_labels']} orphaned labels in {stats['seconds']:.2f}s"
+        )
+    elif not args.import_blobs:
+        init_db(args.workspace)
+    if args.import_blobs:
+        print(f"Imported {import_blobs(args.workspace)} blobs")
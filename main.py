@@ -1,47 +1,92 @@
 import sys
 import os
 import sqlite3
-import glob
-from natsort import natsort
 
 from PySide6.QtWidgets import (
     QApplication,
+    QDialog,
+    QLabel,
     QMainWindow,
     QFileDialog,
+    QInputDialog,
     QMessageBox,
     QListWidgetItem,
     QTableWidget,
+    QProgressDialog,
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QPixmap
 
 # Import the class from the generated ui_labeling_tool.py
 from ui_labeling_tool import Ui_MainWindow
 from init_db import init_db
-from modules.face_segementation import FaceSegmentation
-from modules.blob_detector import BlobDetector
+from modules.database import LabelDatabase
+from modules.label_index import LabelIndex
+from modules.image_cache import ImageCache, load_image
+from modules.pyramid_cache import PyramidCache, pyramid_levels
+from modules.workspace_index import WorkspaceIndex, insert_sorted
+from modules.workspace import LEGACY_MASK_SUFFIX, MASK_SUFFIX
+from modules.model_loader import ModelLoader
+from modules.frame import Frame
+from modules.blob_detector import (
+    BlobDetector,
+    detect_blobs_parallel,
+    params_to_dict,
+)
+from modules.mask_store import MaskStore
+from modules.exporter import export_format_for, export_labels
+from modules.bulk_labeling import BulkLabelDialog, ThumbnailDialog
+from modules.job_queue import HIGH_PRIORITY, LOW_PRIORITY, JobQueue
+from modules.tracing import enable_from_env, span, traced, write_report
+
+# how many images to decode ahead of / behind the current one while navigating
+PREFETCH_AHEAD = 4
+PREFETCH_BEHIND = 1
+# images whose renditions are built when a workspace is opened
+PYRAMID_SCHEDULE_AHEAD = 32
+# smooth re-scaling waits until the window has not been resized for this long
+RESIZE_SETTLE_MS = 150
 
 
 class LabelingTool(QMainWindow, Ui_MainWindow):
-    def __init__(self, segmenter):
+    def __init__(self, segmenter=None):
         super().__init__()
         self.setupUi(self)  # This initializes all widgets from the UI
 
         # Store database path
         self.dbStatus.setText("Waiting for directory selection...")
         self.db_path = ""
+        self.db = None
+        # in-memory image/label lookups so a keystroke needs no SELECT
+        self.label_index = LabelIndex()
         self.workspace_path = ""
 
         # A list to keep track of images in the selected directory
         self.image_paths = []
         self.seg_image_folder = ""
         self.seg_mask_folder = ""
-        self.seg_image_paths = []
         self.blob_image_folder = ""
         self.blob_keypoints_folder = ""
-        self.blob_image_paths = []
+        # raw images and derived outputs present on disk, kept up to date
+        self.workspace_index = None
 
         self.current_index = 0
+        # +1 when moving forward through the images, -1 when moving back
+        self.nav_direction = 1
+        # decoded images are kept at most at screen size
+        self.image_cache = ImageCache(
+            max_size=QApplication.primaryScreen().availableSize()
+        )
+        # on-disk display renditions of the open workspace
+        self.pyramid_cache = None
+        # decoded frames of the current image, label widget -> QImage
+        self.current_frames = {}
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(RESIZE_SETTLE_MS)
+        self.resize_timer.timeout.connect(
+            lambda: self.render_frames(Qt.TransformationMode.SmoothTransformation)
+        )
         self.focus_mode_enabled = False
         # Connect buttons (matching the object names from Qt Designer)
         self.actionOpen_Workspace.triggered.connect(self.open_directory)
@@ -57,6 +102,17 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
         self.actionBlob_Detector_With_Face_Parsing.triggered.connect(
             self.blob_detector_current_image
         )
+        self.actionBlob_Detector_On_Workspace.triggered.connect(
+            self.blob_detector_workspace
+        )
+        self.actionCancel_Pending_Jobs.triggered.connect(
+            lambda: self.cancel_pending_jobs()
+        )
+        self.actionExport_Labels.triggered.connect(self.export_labels)
+        self.actionBulk_Label_Images.triggered.connect(self.bulk_label_images)
+        self.actionThumbnail_View.triggered.connect(self.open_thumbnail_view)
+        # non-modal grid of the workspace images, see open_thumbnail_view
+        self.thumbnail_dialog = None
 
         self.addLabelButton.clicked.connect(self.add_label)
         self.removeLabelButton.clicked.connect(self.remove_label)
@@ -64,19 +120,34 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
         self.nextImageButton.clicked.connect(self.next_image)
         self.focusModeButton.clicked.connect(self.set_focus_mode)
 
+        # the segmentation model is loaded in the background by start_model_loading,
+        # actions that need it before then are queued
         self.seg_tool = segmenter
+        self.model_loader = None
+        self.pending_model_actions = []
+        self.modelStatus = QLabel("Model: ready" if segmenter else "Model: not loaded")
+        self.statusbar.addPermanentWidget(self.modelStatus)
         self.blob_detector = BlobDetector()
 
+        # segmentation and blob detection run in the background
+        self.job_queue = JobQueue(self)
+        self.job_queue.finished.connect(self.on_job_finished)
+        self.job_queue.failed.connect(self.on_job_failed)
+        self.job_queue.pending_changed.connect(self.on_pending_jobs_changed)
+        # images whose blobs are detected as soon as their segmentation is done
+        self.blobs_after_segmentation = set()
+        self.jobStatus = QLabel()
+        self.statusbar.addPermanentWidget(self.jobStatus)
+
         # (Optional) Connect other signals/slots or do other setup...
 
     def open_directory(self):
         """Open a file dialog to select a directory containing images."""
         directory = QFileDialog.getExistingDirectory(self, "Select Directory")
         if directory:
-            self.image_paths = natsort.natsorted(
-                glob.glob(os.path.join(directory, "*.jpg"))
-                + glob.glob(os.path.join(directory, "*.png"))
-            )
+            # results of jobs still running for the previous workspace are dropped
+            self.cancel_pending_jobs(drop_running=True)
+            self.close_thumbnail_view()
             self.workspace_path = directory
 
             self.seg_image_folder, self.seg_mask_folder = self.find_segmentation_folder(
@@ -97,16 +168,19 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
                     self.create_blob_folder(self.workspace_path)
                 )
 
-            self.seg_image_paths = natsort.natsorted(
-                glob.glob(os.path.join(self.seg_image_folder, "*.jpg"))
-                + glob.glob(os.path.join(self.seg_image_folder, "*.png"))
-            )
-
-            self.blob_image_paths = natsort.natsorted(
-                glob.glob(os.path.join(self.blob_image_folder, "*.jpg"))
-                + glob.glob(os.path.join(self.blob_image_folder, "*.png"))
+            if self.workspace_index is not None:
+                self.workspace_index.deleteLater()
+            self.workspace_index = WorkspaceIndex(
+                self.workspace_path,
+                self.seg_image_folder,
+                self.seg_mask_folder,
+                self.blob_image_folder,
             )
+            self.workspace_index.changed.connect(self.on_workspace_changed)
+            self.image_paths = self.workspace_index.image_paths()
+            self.open_pyramid_cache(self.workspace_path)
 
+            self.close_database()
             self.db_path = self.find_database(self.workspace_path)
             if not os.path.exists(self.db_path):
                 QMessageBox.warning(
@@ -117,15 +191,13 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
                 self.dbStatus.setText(f"Database not found.")
             else:
                 self.dbStatus.setText(f"Database found.")
+                self.db = LabelDatabase(self.db_path)
+                self.label_index.load_images(self.db)
                 self.load_labels()
                 self.current_index = 0
 
                 # check number of images in database with the number of images in the directory
-                conn = sqlite3.connect(self.db_path)
-                c = conn.cursor()
-                c.execute("SELECT count(*) FROM images")
-                db_image_count = c.fetchone()[0]
-                conn.close()
+                db_image_count = self.db.image_count()
 
                 if db_image_count != len(self.image_paths):
                     QMessageBox.warning(
@@ -136,6 +208,48 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
 
                 self.update_image_display()
 
+    def on_workspace_changed(self, kind, added, removed):
+        """Apply files added or removed outside the app to the open workspace."""
+        for path in added + removed:
+            self.image_cache.invalidate(path)
+        if self.pyramid_cache is not None and removed:
+            self.pyramid_cache.remove(removed)
+
+        if kind == "raw":
+            current_path = (
+                self.image_paths[self.current_index] if self.image_paths else None
+            )
+            if removed:
+                removed_paths = set(removed)
+                self.image_paths = [
+                    path for path in self.image_paths if path not in removed_paths
+                ]
+            insert_sorted(self.image_paths, added)
+            # stay on the same image if it is still there
+            if current_path in self.image_paths:
+                self.current_index = self.image_paths.index(current_path)
+            elif self.image_paths:
+                self.current_index = min(self.current_index, len(self.image_paths) - 1)
+            else:
+                self.current_index = 0
+            self.statusbar.showMessage(
+                f"{len(added)} images added, {len(removed)} images removed, "
+                "suggested update database."
+            )
+            self.update_image_display()
+            return
+
+        if not self.image_paths:
+            return
+        # only redraw if the change touches the image on screen
+        seg_image_path, blob_image_path = self.derived_image_paths(
+            self.image_paths[self.current_index]
+        )
+        if kind == "segmented" and seg_image_path in added + removed:
+            self.show_image(self.imageLabelTabSeg, seg_image_path)
+        elif kind == "blob" and blob_image_path in added + removed:
+            self.show_image(self.imageLabelTabBlob, blob_image_path)
+
     def create_segmentation_folder(self, workspace_path):
         """Create a folder for the segmented images."""
         if self.workspace_path:
@@ -174,9 +288,32 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
             return blob_folder, keypoints_folder
         return None
 
+    def open_pyramid_cache(self, workspace_path):
+        """Serve display images from the workspace rendition cache."""
+        if self.pyramid_cache is not None:
+            self.pyramid_cache.shutdown()
+        # the largest rendition covers the screen, so full screen display
+        # never decodes the source
+        self.pyramid_cache = PyramidCache(
+            os.path.join(workspace_path, ".cache", "pyramid"),
+            pyramid_levels(self.image_cache.max_size),
+        )
+        self.image_cache.clear()
+        self.image_cache.loader = self.pyramid_cache.load
+        self.pyramid_cache.prune()
+        # build the renditions around the first image in the background, the
+        # display and prefetch schedule the others as they are navigated to
+        self.pyramid_cache.schedule(self.image_paths[:PYRAMID_SCHEDULE_AHEAD])
+
     def find_database(self, workspace_path):
         return os.path.join(workspace_path, "labels.db")
 
+    def close_database(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.label_index.clear()
+
     def init_database(self, workspace_path):
         if not workspace_path:
             QMessageBox.warning(
@@ -195,9 +332,12 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
             if reply == QMessageBox.No:
                 return
             else:
-                os.remove(self.db_path)
+                self.close_database()
+                LabelDatabase.remove(self.find_database(workspace_path))
         init_db(workspace_path)
         self.db_path = self.find_database(workspace_path)
+        self.db = LabelDatabase(self.db_path)
+        self.label_index.load_images(self.db)
         self.dbStatus.setText(f"Database found.")
         self.load_labels()
         self.current_index = 0
@@ -217,49 +357,92 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
                 "Database not found. Please initialize the database first.",
             )
             return
-        # find the images that is new and add them to the database
-        db_image_paths = []
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT image_path FROM images")
-        rows = c.fetchall()
-        conn.close()
-        for (image_path,) in rows:
-            db_image_paths.append(image_path)
-
-        new_images = list(set(self.image_paths) - set(db_image_paths))
-        if new_images:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            for image_path in new_images:
-                c.execute("INSERT INTO images (image_path) VALUES (?)", (image_path,))
-            conn.commit()
-            conn.close()
-
-        # check if there are images in the database that are not in the directory
-
-        images_remove = list(set(db_image_paths) - set(self.image_paths))
-        if images_remove:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            for image_path in images_remove:
-                c.execute("DELETE FROM images WHERE image_path=?", (image_path,))
-            conn.commit()
-            conn.close()
+        # add the new images and drop the ones no longer in the directory,
+        # together with their labels, in a single transaction
+        stats = self.db.sync_images(self.image_paths)
+        self.statusbar.showMessage(
+            f"Database updated: {stats['added']} images added, "
+            f"{stats['removed']} removed, {stats['orphaned_labels']} orphaned "
+            f"labels cleaned up in {stats['seconds']:.2f}s."
+        )
 
+        self.label_index.load_images(self.db)
         self.update_image_display()
 
+    def export_labels(self):
+        """Stream the labels (and blobs) of the workspace to a file."""
+        if self.db is None:
+            QMessageBox.warning(
+                self,
+                "Warning",
+                "Database not found. Please initialize the database first.",
+            )
+            return
+
+        filters = {
+            "CSV (*.csv)": ".csv",
+            "JSON Lines (*.jsonl)": ".jsonl",
+            "COCO JSON (*.json)": ".json",
+        }
+        output_path, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export Labels",
+            os.path.join(self.workspace_path, "labels_export.csv"),
+            ";;".join(filters),
+        )
+        if not output_path:
+            return
+        if export_format_for(output_path) is None:
+            output_path += filters.get(selected_filter, ".csv")
+
+        label_names = [
+            self.label_index.label_names[label_id]
+            for label_id in sorted(self.label_index.label_names)
+        ]
+        choice, ok = QInputDialog.getItem(
+            self,
+            "Export Labels",
+            "Export the images with label:",
+            ["All images"] + label_names,
+            0,
+            False,
+        )
+        if not ok:
+            return
+
+        progress = QProgressDialog(
+            "Exporting labels...", None, 0, len(self.image_paths), self
+        )
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(0)
+
+        def on_progress(done):
+            progress.setValue(min(done, progress.maximum()))
+            QApplication.processEvents()
+
+        try:
+            counts = export_labels(
+                self.db_path,
+                output_path,
+                label_names=None if choice == "All images" else [choice],
+                progress=on_progress,
+            )
+        except (OSError, ValueError, sqlite3.Error) as e:
+            QMessageBox.warning(self, "Warning", f"Export failed: {e}")
+            return
+        finally:
+            progress.close()
+        self.statusbar.showMessage(
+            f"Exported {counts['images']} images, {counts['labels']} labels and "
+            f"{counts['blobs']} blobs to {output_path} in {counts['seconds']:.2f}s."
+        )
+
     def load_labels(self):
         """Load label definitions from the SQLite database into the labelList."""
         self.labelList.clear()
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT id, label_name, key_binding FROM labels")
-        rows = c.fetchall()
-        conn.close()
-
-        for label_id, label_name, key_binding in rows:
+        self.label_index.load_labels(self.db)
+        for label_id, label_name, key_binding in self.db.labels():
             item = QListWidgetItem(f"{label_name} ({key_binding})")
             item.setData(Qt.ItemDataRole.UserRole, label_id)
             self.labelList.addItem(item)
@@ -269,31 +452,29 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
         label_name = self.labelNameEdit.text().strip()
         key_binding = self.keyBindEdit.text().strip()
 
+        if self.db is None:
+            QMessageBox.warning(
+                self,
+                "Warning",
+                "Database not found. Please initialize the database first.",
+            )
+            return
+
         if not label_name or not key_binding:
             QMessageBox.warning(
                 self, "Warning", "Label name or key binding cannot be empty."
             )
             return
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
         # Example check for duplicate key binding
-        c.execute("SELECT count(*) FROM labels WHERE key_binding=?", (key_binding,))
-        if c.fetchone()[0] > 0:
+        if self.db.key_binding_exists(key_binding):
             QMessageBox.warning(
                 self, "Warning", f"Key '{key_binding}' is already bound."
             )
-            conn.close()
             return
 
         # Insert label
-        c.execute(
-            "INSERT INTO labels (label_name, key_binding) VALUES (?, ?)",
-            (label_name, key_binding),
-        )
-        conn.commit()
-        conn.close()
+        self.db.add_label(label_name, key_binding)
 
         # Reload labels
         self.load_labels()
@@ -305,22 +486,14 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
     def remove_label(self):
         """Remove the selected label from the database and reload the list."""
         selected_item = self.labelList.currentItem()
-        if not selected_item:
+        if not selected_item or self.db is None:
             return
 
         label_id = selected_item.data(Qt.ItemDataRole.UserRole)
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
-        # Remove label from labels table
-        c.execute("DELETE FROM labels WHERE id=?", (label_id,))
-
-        # Remove label from image_labels junction table
-        c.execute("DELETE FROM image_labels WHERE label_id=?", (label_id,))
-
-        conn.commit()
-        conn.close()
+        # Remove label from labels table and the image_labels junction table
+        self.db.remove_label(label_id)
+        self.label_index.remove_label(label_id)
 
         # Reload labels
         self.load_labels()
@@ -352,53 +525,89 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
             self.focusStatus.setText("OFF")
             self.switch_widget_focus(True)
 
+    def derived_image_paths(self, image_path):
+        """Return (segmented image path, blob image path) for a raw image."""
+        base_name = os.path.basename(image_path).split(".")[0]
+        return (
+            os.path.join(self.seg_image_folder, base_name + "_segmented.png"),
+            os.path.join(self.blob_image_folder, base_name + "_blobs.png"),
+        )
+
+    def show_image(self, label, image_path):
+        """Show an image from the cache in a label, scaled to fit it."""
+        with span("display.load", image=image_path):
+            self.current_frames[label] = self.image_cache.load(image_path)
+        self.render_frame(label, Qt.TransformationMode.SmoothTransformation)
+
+    @traced("display.render_frame")
+    def render_frame(self, label, transform_mode):
+        """Scale the decoded frame of a label to the label size, no disk access."""
+        image = self.current_frames.get(label)
+        if image is None or image.isNull():
+            label.clear()
+            return
+        image = image.scaled(
+            label.width(),
+            label.height(),
+            Qt.AspectRatioMode.KeepAspectRatio,
+            transform_mode,
+        )
+        label.setPixmap(QPixmap.fromImage(image))
+
+    def render_frames(self, transform_mode):
+        for label in self.current_frames:
+            self.render_frame(label, transform_mode)
+
+    def prefetch_neighbours(self):
+        """Decode the next images in the navigation direction in the background."""
+        steps = [self.nav_direction * step for step in range(1, PREFETCH_AHEAD + 1)]
+        steps += [-self.nav_direction * step for step in range(1, PREFETCH_BEHIND + 1)]
+        paths = []
+        for step in steps:
+            image_path = self.image_paths[
+                (self.current_index + step) % len(self.image_paths)
+            ]
+            paths.append(image_path)
+            seg_image_path, blob_image_path = self.derived_image_paths(image_path)
+            if self.workspace_index.has("segmented", seg_image_path):
+                paths.append(seg_image_path)
+            if self.workspace_index.has("blob", blob_image_path):
+                paths.append(blob_image_path)
+        self.image_cache.prefetch(paths)
+
+    @traced("display.update_image_display")
     def update_image_display(self):
         if not self.image_paths:
+            self.current_frames.clear()
             self.imageLabelTabRaw.clear()
             self.imageLabelTabSeg.clear()
             return
-        pixmap = QPixmap(self.image_paths[self.current_index])
-        pixmap = pixmap.scaled(
-            self.imageLabelTabRaw.width(),
-            self.imageLabelTabRaw.height(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-        )
-        self.imageLabelTabRaw.setPixmap(pixmap)
-        raw_image_name = os.path.basename(self.image_paths[self.current_index])
+        image_path = self.image_paths[self.current_index]
+        self.show_image(self.imageLabelTabRaw, image_path)
+        raw_image_name = os.path.basename(image_path)
         self.imageIDCount.setText(
             f"{self.current_index+1}/{len(self.image_paths)}, {raw_image_name}"
         )
         self.update_cur_image_labels_display()
 
-        if self.seg_image_paths:
-            # match the segmented image with the raw image based on the name
-            seg_image_name = raw_image_name.split(".")[0] + "_segmented.png"
-            seg_image_path = os.path.join(self.seg_image_folder, seg_image_name)
-            if os.path.exists(seg_image_path):
-                seg_pixmap = QPixmap(seg_image_path)
-                seg_pixmap = seg_pixmap.scaled(
-                    self.imageLabelTabSeg.width(),
-                    self.imageLabelTabSeg.height(),
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                )
-                self.imageLabelTabSeg.setPixmap(seg_pixmap)
-            else:
-                self.imageLabelTabSeg.clear()
-
-        if self.blob_image_paths:
-            # match the segmented image with the raw image based on the name
-            blob_image_name = raw_image_name.split(".")[0] + "_blobs.png"
-            blob_image_path = os.path.join(self.blob_image_folder, blob_image_name)
-            if os.path.exists(blob_image_path):
-                blob_pixmap = QPixmap(blob_image_path)
-                blob_pixmap = blob_pixmap.scaled(
-                    self.imageLabelTabBlob.width(),
-                    self.imageLabelTabBlob.height(),
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                )
-                self.imageLabelTabBlob.setPixmap(blob_pixmap)
-            else:
-                self.imageLabelTabBlob.clear()
+        # match the segmented and blob images with the raw image based on the name
+        seg_image_path, blob_image_path = self.derived_image_paths(image_path)
+        if self.workspace_index.has("segmented", seg_image_path):
+            self.show_image(self.imageLabelTabSeg, seg_image_path)
+        else:
+            self.current_frames.pop(self.imageLabelTabSeg, None)
+            self.imageLabelTabSeg.clear()
+
+        if self.workspace_index.has("blob", blob_image_path):
+            self.show_image(self.imageLabelTabBlob, blob_image_path)
+        else:
+            self.current_frames.pop(self.imageLabelTabBlob, None)
+            self.imageLabelTabBlob.clear()
+
+        with span("display.prefetch"):
+            self.prefetch_neighbours()
+        # the image on screen goes ahead of any other queued job
+        self.job_queue.prioritise(image_path)
 
     def keyPressEvent(self, event):
         # Example: if user typed "A", label the current image with label that has key_binding='A'
@@ -415,113 +624,153 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
 
     def prev_image(self):
         if self.image_paths:
+            self.nav_direction = -1
             self.current_index = (self.current_index - 1) % len(self.image_paths)
             self.update_image_display()
 
     def next_image(self):
         if self.image_paths:
+            self.nav_direction = 1
             self.current_index = (self.current_index + 1) % len(self.image_paths)
             self.update_image_display()
 
+    @traced("ui.label_current_image")
     def label_current_image(self, pressed_key):
-        if not self.image_paths:
+        if not self.image_paths or self.db is None:
             return
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
         # Find label by pressed key
-        c.execute("SELECT id FROM labels WHERE UPPER(key_binding)=?", (pressed_key,))
-        result = c.fetchone()
-        # if result is None:
-        #     QMessageBox.warning(
-        #         self, "Warning", f"No label found for key '{pressed_key}'."
-        #     )
-        #     conn.close()
-        #     return
-
-        # print(f"Labeling image {self.current_index+1} with label {label_id}")
+        label_id = self.label_index.label_keys.get(pressed_key)
+        if label_id is None:
+            return
+
         # we find the image id from the image path
-        if result is None:
+        image_id = self.label_index.image_ids.get(self.image_paths[self.current_index])
+        if image_id is None:
             return
 
-        label_id = result[0]
-        c.execute(
-            "SELECT id FROM images WHERE image_path=?",
-            (self.image_paths[self.current_index],),
-        )
-        image_id = c.fetchone()[0]
+        # add the label to the image, or remove it if it is already there
+        if self.label_index.has_label(image_id, label_id):
+            self.db.remove_image_label(image_id, label_id)
+            self.label_index.set_label(image_id, label_id, False)
+        else:
+            self.db.add_image_label(image_id, label_id)
+            self.label_index.set_label(image_id, label_id, True)
 
-        # print(f"Current image id: {image_id}")
-        # check if the label is already associated with the image
-        c.execute(
-            "SELECT count(*) FROM image_labels WHERE image_id=? AND label_id=?",
-            (image_id, label_id),
+        self.update_cur_image_labels_display()
+
+    @traced("ui.label_images")
+    def label_images(self, image_paths, label_id, enabled):
+        """Add (or remove) a label on many images with one database transaction."""
+        if self.db is None:
+            return
+        image_ids = [
+            self.label_index.image_ids[image_path]
+            for image_path in image_paths
+            if image_path in self.label_index.image_ids
+        ]
+        changed = self.db.set_label_for_images(image_ids, label_id, enabled)
+        self.label_index.set_label_for_images(image_ids, label_id, enabled)
+        self.update_cur_image_labels_display()
+        label_name = self.label_index.label_names.get(label_id, label_id)
+        self.statusbar.showMessage(
+            f"Label {label_name} {'added to' if enabled else 'removed from'} "
+            f"{changed} of {len(image_ids)} images."
         )
 
-        if c.fetchone()[0] > 0:
-            # remove the label from the image
-            c.execute(
-                "DELETE FROM image_labels WHERE image_id=? AND label_id=?",
-                (image_id, label_id),
-            )
-        else:
-            c.execute(
-                "INSERT INTO image_labels (image_id, label_id) VALUES (?, ?)",
-                (image_id, label_id),
+    def labels_database_ready(self):
+        if not self.image_paths or self.db is None:
+            QMessageBox.warning(
+                self, "Warning", "Please open a workspace with a database first."
             )
+            return False
+        if not self.label_index.label_names:
+            QMessageBox.warning(self, "Warning", "Please add a label first.")
+            return False
+        return True
+
+    def bulk_label_images(self):
+        """Label a range of images, or every image matching a filter."""
+        if not self.labels_database_ready():
+            return
+        dialog = BulkLabelDialog(
+            self.label_index.label_names,
+            len(self.image_paths),
+            self.current_index,
+            self,
+        )
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        image_paths = dialog.select(self.image_paths, self.label_index)
+        if not image_paths:
+            self.statusbar.showMessage("No images match, nothing was labeled.")
+            return
+        self.label_images(image_paths, dialog.label_id(), dialog.enabled())
 
-        conn.commit()
-        conn.close()
+    def describe_image(self, image_path):
+        image_id = self.label_index.image_ids.get(image_path)
+        labels = ", ".join(self.label_index.labels_for_image(image_id)) or "no labels"
+        return f"{os.path.basename(image_path)}\n{labels}"
 
-        self.update_cur_image_labels_display()
+    def open_thumbnail_view(self):
+        """Show the images as thumbnails; a multi-selection is labeled at once."""
+        if not self.labels_database_ready():
+            return
+        self.close_thumbnail_view()
+        loader = self.pyramid_cache.load if self.pyramid_cache else load_image
+        self.thumbnail_dialog = ThumbnailDialog(
+            self.image_paths,
+            self.label_index.label_names,
+            self.describe_image,
+            loader,
+            self,
+        )
+        self.thumbnail_dialog.label_requested.connect(self.label_images)
+        self.thumbnail_dialog.image_activated.connect(self.show_image_path)
+        self.thumbnail_dialog.select_row(self.current_index)
+        self.thumbnail_dialog.show()
+
+    def close_thumbnail_view(self):
+        if self.thumbnail_dialog is not None:
+            self.thumbnail_dialog.close()
+            self.thumbnail_dialog.deleteLater()
+            self.thumbnail_dialog = None
+
+    def show_image_path(self, image_path):
+        # the workspace may have changed since the thumbnail view was opened
+        if image_path in self.image_paths:
+            index = self.image_paths.index(image_path)
+            self.nav_direction = 1 if index >= self.current_index else -1
+            self.current_index = index
+            self.update_image_display()
 
+    @traced("ui.update_cur_image_labels_display")
     def update_cur_image_labels_display(self):
         """Update the list of labels for the current image."""
+        self.curImageLabelsList.clear()
         if not self.image_paths:
-            self.curImageLabelsList.clear()
             return
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
-        # given the image path, find the labels associated with it in the junction table
-        # Create a junction table for image-label relationships
-        # """
-        # CREATE TABLE IF NOT EXISTS image_labels (
-        #     image_id INTEGER,
-        #     label_id INTEGER,
-        #     PRIMARY KEY (image_id, label_id),
-        #     FOREIGN KEY (image_id) REFERENCES images(id),
-        #     FOREIGN KEY (label_id) REFERENCES labels(id)
-        # )
-        # """
-
         # find the image_id from the image path
-        c.execute(
-            "SELECT id FROM images WHERE image_path=?",
-            (self.image_paths[self.current_index],),
-        )
-        image_id = c.fetchone()[0]
-
-        # print(f"Current image id: {image_id}")
-
-        c.execute(
-            """
-            SELECT label_name
-            FROM labels
-            JOIN image_labels ON labels.id = image_labels.label_id
-            WHERE image_labels.image_id = ?
-            """,
-            (image_id,),
-        )
-        image_labels = c.fetchall()
-        conn.close()
+        image_id = self.label_index.image_ids.get(self.image_paths[self.current_index])
 
-        self.curImageLabelsList.clear()
-        for (label_name,) in image_labels:
+        for label_name in self.label_index.labels_for_image(image_id):
             self.curImageLabelsList.addItem(label_name)
 
+    def closeEvent(self, event):
+        if self.model_loader is not None and self.model_loader.isRunning():
+            # loading the model can take long (first download), do not wait
+            self.model_loader.detach()
+            self.model_loader = None
+        self.job_queue.cancel_all()
+        self.job_queue.wait()
+        self.close_thumbnail_view()
+        self.close_database()
+        self.image_cache.shutdown()
+        if self.pyramid_cache is not None:
+            self.pyramid_cache.shutdown()
+        super().closeEvent(event)
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
         # move the right groupbox to the right side of the window
@@ -560,7 +809,45 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
         self.imageLabelTabBlob.setGeometry(
             0, 0, self.imageTab.width(), self.imageTab.height()
         )
-        self.update_image_display()  # re-scale image to the label size
+        # re-scale the decoded frames to the label size: fast while the window
+        # is being dragged, smooth once it has settled
+        self.render_frames(Qt.TransformationMode.FastTransformation)
+        self.resize_timer.start()
+
+    def start_model_loading(self):
+        """Load the face segmentation model on a background thread."""
+        if self.seg_tool is not None or self.model_loader is not None:
+            return
+        self.modelStatus.setText("Model: loading...")
+        self.model_loader = ModelLoader(self)
+        self.model_loader.loaded.connect(self.on_model_loaded)
+        self.model_loader.failed.connect(self.on_model_failed)
+        self.model_loader.start()
+
+    def on_model_loaded(self, segmenter):
+        self.seg_tool = segmenter
+        self.modelStatus.setText("Model: ready")
+        # run the segmentation actions requested while the model was loading
+        actions, self.pending_model_actions = self.pending_model_actions, []
+        for action in actions:
+            action()
+
+    def on_model_failed(self, message):
+        self.model_loader = None
+        self.pending_model_actions = []
+        self.modelStatus.setText("Model: unavailable")
+        QMessageBox.warning(
+            self, "Warning", f"Face segmentation model failed to load: {message}"
+        )
+
+    def when_model_ready(self, action):
+        """Run action now if the model is loaded, otherwise once it is."""
+        if self.seg_tool is not None:
+            action()
+            return
+        self.pending_model_actions.append(action)
+        self.statusbar.showMessage("Waiting for the segmentation model to load...")
+        self.start_model_loading()
 
     def face_segmentation_current_image(self):
         if not self.image_paths:
@@ -578,22 +865,81 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
                 self, "Warning", "Please select a directory for mask images first."
             )
             return
-        image_path = self.image_paths[self.current_index]
+        self.request_segmentation(self.image_paths[self.current_index])
+
+    def job_priority(self, image_path):
+        """Jobs for the image on screen run before the rest of the queue."""
+        if self.image_paths and image_path == self.image_paths[self.current_index]:
+            return HIGH_PRIORITY
+        return LOW_PRIORITY
+
+    def mask_path_for(self, image_path):
+        """Return the mask of an image, falling back to a legacy .npy mask."""
+        base_name = os.path.basename(image_path).split(".")[0]
+        mask_path = os.path.join(self.seg_mask_folder, base_name + MASK_SUFFIX)
+        legacy_path = os.path.join(self.seg_mask_folder, base_name + LEGACY_MASK_SUFFIX)
+        if not self.workspace_index.has("mask", mask_path) and self.workspace_index.has(
+            "mask", legacy_path
+        ):
+            return legacy_path
+        return mask_path
+
+    def request_segmentation(self, image_path):
+        """Queue a segmentation job, once the model is available."""
         seg_image_name = os.path.basename(image_path).split(".")[0] + "_segmented.png"
         seg_image_path = os.path.join(self.seg_image_folder, seg_image_name)
-        seg_mask_name = os.path.basename(image_path).split(".")[0] + "_mask.npy"
+        seg_mask_name = os.path.basename(image_path).split(".")[0] + MASK_SUFFIX
         seg_mask_path = os.path.join(self.seg_mask_folder, seg_mask_name)
 
-        # print(f"Segmenting face in {image_path}")
-        # print(f"Saving segmented image to {seg_image_path}")
-        # print(f"Saving mask to {seg_mask_path}")
-        self.seg_tool.segment_face(image_path, seg_image_path, seg_mask_path)
-        # update self.seg_image_paths
-        self.seg_image_paths = natsort.natsorted(
-            glob.glob(os.path.join(self.seg_image_folder, "*.jpg"))
-            + glob.glob(os.path.join(self.seg_image_folder, "*.png"))
+        self.when_model_ready(
+            lambda: self.job_queue.submit(
+                "segment",
+                image_path,
+                lambda: self.segment_image(image_path, seg_image_path, seg_mask_path),
+                self.job_priority(image_path),
+            )
         )
-        self.update_image_display()
+
+    def request_blobs(self, image_path, frame=None):
+        """Queue a blob detection job with the current detector params.
+
+        frame is the image already decoded by a segmentation job, if any.
+        """
+        base_name = os.path.basename(image_path).split(".")[0]
+        mask_path = self.mask_path_for(image_path)
+        output_image_name = base_name + "_blobs.png"
+        output_image_path = os.path.join(self.blob_image_folder, output_image_name)
+
+        output_keypoints_name = base_name + "_keypoints.json"
+        output_keypoints_path = os.path.join(
+            self.blob_keypoints_folder, output_keypoints_name
+        )
+        params = self.blob_detector.params
+        params_id = self.db.blob_params_id(params_to_dict(params)) if self.db else None
+        self.job_queue.submit(
+            "blob",
+            image_path,
+            lambda: self.detect_image_blobs(
+                frame or image_path,
+                mask_path,
+                output_image_path,
+                output_keypoints_path,
+                params,
+                params_id,
+            ),
+            self.job_priority(image_path),
+        )
+
+    def segment_image(self, image_path, seg_image_path, seg_mask_path):
+        """Segment one image; runs on a worker thread, so no widget access.
+
+        The decoded frame is returned too, so chained blob detection and the
+        display reuse it instead of decoding the file again.
+        """
+        with span("segment.decode"):
+            frame = Frame.load(image_path)
+        self.seg_tool.segment_face(image_path, seg_image_path, seg_mask_path, frame)
+        return seg_image_path, seg_mask_path, frame
 
     def blob_detector_current_image(self):
         if not self.image_paths:
@@ -613,44 +959,239 @@ class LabelingTool(QMainWindow, Ui_MainWindow):
             return
 
         # check if a face_paring image exists
-        base_name = os.path.basename(self.image_paths[self.current_index]).split(".")[0]
-        seg_image_name = base_name + "_segmented.png"
+        image_path = self.image_paths[self.current_index]
+        seg_image_name = os.path.basename(image_path).split(".")[0] + "_segmented.png"
         seg_image_path = os.path.join(self.seg_image_folder, seg_image_name)
-        if not os.path.exists(seg_image_path):
-            # segment the face first
-            self.face_segmentation_current_image()
+        if self.workspace_index.has("segmented", seg_image_path):
+            self.request_blobs(image_path)
+            return
 
-        image_path = self.image_paths[self.current_index]
-        mask_path = os.path.join(
-            self.seg_mask_folder,
-            os.path.basename(image_path).split(".")[0] + "_mask.npy",
+        # segment the face first
+        self.blobs_after_segmentation.add(image_path)
+        self.request_segmentation(image_path)
+
+    def detect_image_blobs(
+        self,
+        image_path,
+        mask_path,
+        output_image_path,
+        output_keypoints_path,
+        params,
+        params_id,
+    ):
+        """Detect and draw blobs of one image; runs on a worker thread.
+
+        image_path may be a Frame; either way the image is decoded once.
+        """
+        # each job gets its own detector, cv2 detectors are not shared across threads
+        blob_detector = BlobDetector()
+        blob_detector.set_params(params)
+
+        if isinstance(image_path, str):
+            with span("blobs.decode"):
+                frame = Frame.load(image_path)
+        else:
+            frame = image_path
+        keypoints = blob_detector.detect_blobs(frame)
+        drawn, blobs = blob_detector.render_blobs(frame, mask_path, keypoints)
+        blob_detector.save_blobs(drawn, blobs, output_image_path, output_keypoints_path)
+        # the drawn image goes to the display cache, it is not read back from disk
+        with span("blobs.display_image"):
+            display_image = Frame(drawn).display_image(self.image_cache.max_size)
+        # the database connection belongs to the GUI thread, see on_job_finished
+        return output_image_path, blobs, params_id, display_image
+
+    def on_job_finished(self, kind, image_path, result):
+        """Record the outputs of a finished job and refresh only its tab."""
+        on_screen = (
+            self.image_paths and image_path == self.image_paths[self.current_index]
         )
-        output_image_name = base_name + "_blobs.png"
-        output_image_path = os.path.join(self.blob_image_folder, output_image_name)
-
-        output_keypoints_name = base_name + "_keypoints.json"
-        output_keypoints_path = os.path.join(
-            self.blob_keypoints_folder, output_keypoints_name
+        if kind == "segment":
+            seg_image_path, seg_mask_path, frame = result
+            self.image_cache.invalidate(seg_image_path)
+            if self.image_cache.get(image_path) is None:
+                self.image_cache.put(
+                    image_path, frame.display_image(self.image_cache.max_size)
+                )
+            self.workspace_index.add("segmented", seg_image_path)
+            self.workspace_index.add("mask", seg_mask_path)
+            self.discard_stored_mask(image_path)
+            if on_screen:
+                self.show_image(self.imageLabelTabSeg, seg_image_path)
+            if image_path in self.blobs_after_segmentation:
+                self.blobs_after_segmentation.discard(image_path)
+                self.request_blobs(image_path, frame)
+        elif kind == "blob":
+            output_image_path, blobs, params_id, display_image = result
+            self.store_blobs([(image_path, blobs)], params_id)
+            self.image_cache.put(output_image_path, display_image)
+            self.workspace_index.add("blob", output_image_path)
+            if on_screen:
+                self.show_image(self.imageLabelTabBlob, output_image_path)
+
+    def discard_stored_mask(self, image_path):
+        """Drop the mask store copy of a mask that was just written again."""
+        store_folder = MaskStore.default_folder(self.workspace_path)
+        image_id = self.label_index.image_ids.get(image_path)
+        if image_id is None or not MaskStore.exists(store_folder):
+            return
+        store = MaskStore(store_folder, writable=True)
+        try:
+            store.discard([image_id])
+        finally:
+            store.close()
+
+    def store_blobs(self, image_blobs, params_id):
+        """Save (image_path, blobs) results in the blobs table of labels.db."""
+        if self.db is None:
+            return
+        self.db.replace_blobs(
+            (
+                (self.label_index.image_ids[image_path], blobs)
+                for image_path, blobs in image_blobs
+                if image_path in self.label_index.image_ids
+            ),
+            params_id,
         )
-        keypoints = self.blob_detector.detect_blobs(image_path)
-        self.blob_detector.draw_blobs(
-            image_path, mask_path, keypoints, output_image_path, output_keypoints_path
+
+    def on_job_failed(self, kind, image_path, message):
+        self.blobs_after_segmentation.discard(image_path)
+        self.statusbar.showMessage(
+            f"{kind} job failed for {os.path.basename(image_path)}: {message}"
         )
 
-        # update self.blob_image_paths
-        self.blob_image_paths = natsort.natsorted(
-            glob.glob(os.path.join(self.blob_image_folder, "*.jpg"))
-            + glob.glob(os.path.join(self.blob_image_folder, "*.png"))
+    def on_pending_jobs_changed(self, count):
+        self.jobStatus.setText(f"Jobs: {count}" if count else "")
+
+    def cancel_pending_jobs(self, drop_running=False):
+        """Drop queued jobs; jobs already running are left to finish.
+
+        With drop_running their results are ignored too, see JobQueue.cancel_all.
+        """
+        self.blobs_after_segmentation.clear()
+        self.pending_model_actions = []
+        self.job_queue.cancel_all(drop_running)
+
+    def blob_detector_workspace(self):
+        """Run the blob detector over every segmented image in a process pool."""
+        if not self.image_paths:
+            QMessageBox.warning(
+                self, "Warning", "Please select a directory containing images first."
+            )
+            return
+
+        # masks imported into the workspace mask store are read from its memory map
+        store_folder = MaskStore.default_folder(self.workspace_path)
+        stored_ids = set()
+        if MaskStore.exists(store_folder):
+            stored_ids = set(MaskStore(store_folder).entries)
+        else:
+            store_folder = None
+
+        jobs = []
+        for image_path in self.image_paths:
+            base_name = os.path.basename(image_path).split(".")[0]
+            mask_path = self.mask_path_for(image_path)
+            if not self.workspace_index.has("mask", mask_path):
+                # images without a face parsing mask are left to the segmentation tools
+                continue
+            image_id = self.label_index.image_ids.get(image_path)
+            if image_id in stored_ids:
+                # the workers check the stored mask against the file
+                mask_ref = (image_id, mask_path)
+            else:
+                mask_ref = mask_path
+            jobs.append(
+                (
+                    image_path,
+                    mask_ref,
+                    os.path.join(self.blob_image_folder, base_name + "_blobs.png"),
+                    os.path.join(
+                        self.blob_keypoints_folder, base_name + "_keypoints.json"
+                    ),
+                )
+            )
+        skipped = len(self.image_paths) - len(jobs)
+        if not jobs:
+            QMessageBox.warning(
+                self, "Warning", "No segmented images found, parse the images first."
+            )
+            return
+
+        progress = QProgressDialog("Detecting blobs...", "Cancel", 0, len(jobs), self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(0)
+
+        done = 0
+        failed = 0
+        total_blobs = 0
+        params_id = None
+        if self.db is not None:
+            params_id = self.db.blob_params_id(
+                params_to_dict(self.blob_detector.params)
+            )
+        # results are written to labels.db in batches, one transaction each
+        pending_blobs = []
+        results = detect_blobs_parallel(
+            jobs, self.blob_detector.params, mask_store_folder=store_folder
+        )
+        try:
+            for image_path, blobs, error in results:
+                done += 1
+                if error is None:
+                    self.workspace_index.add(
+                        "blob", self.derived_image_paths(image_path)[1]
+                    )
+                    pending_blobs.append((image_path, blobs))
+                    if len(pending_blobs) >= 100:
+                        self.store_blobs(pending_blobs, params_id)
+                        pending_blobs = []
+                    total_blobs += len(blobs)
+                else:
+                    failed += 1
+                    print(f"Blob detection failed for {image_path}: {error}")
+                progress.setValue(done)
+                progress.setLabelText(
+                    f"Detecting blobs... {done}/{len(jobs)} images, "
+                    f"{total_blobs} blobs, {failed} failed"
+                )
+                QApplication.processEvents()
+                if progress.wasCanceled():
+                    break
+        finally:
+            results.close()
+            self.store_blobs(pending_blobs, params_id)
+            progress.close()
+            # blob images were rewritten on disk
+            self.image_cache.clear()
+
+        self.statusbar.showMessage(
+            f"Blob detection finished on {done - failed}/{len(jobs)} images, "
+            f"{total_blobs} blobs found, {failed} images failed, "
+            f"{skipped} images without a mask skipped."
         )
         self.update_image_display()
 
 
 def main():
+    # LABELING_TOOL_TRACE=<folder> times the pipeline stages, see modules/tracing.py
+    trace_folder = enable_from_env()
     app = QApplication(sys.argv)
-    segmentor = FaceSegmentation()
-    window = LabelingTool(segmentor)
+    window = LabelingTool()
     window.show()
-    sys.exit(app.exec())
+    # torch and the model load after the window is up, labeling does not wait
+    QTimer.singleShot(0, window.start_model_loading)
+    status = app.exec()
+    if trace_folder:
+        metrics_path, trace_path = write_report(trace_folder)
+        print(f"Span metrics written to {metrics_path}, Chrome trace to {trace_path}")
+    if ModelLoader.detached_running():
+        # a QThread must not be destroyed while running, and the model load
+        # cannot be interrupted: leave without waiting for it
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+    sys.exit(status)
 
 
 if __name__ == "__main__":
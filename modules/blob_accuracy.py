@@ -0,0 +1,134 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from modules.blob_detector import BlobDetector
+from modules.frame import Frame
+
+
+def match_keypoints(exact, approx, tolerance=0.5):
+    """Pair approximate keypoints with exact ones, closest pairs first.
+
+    Two keypoints match when their centres are closer than tolerance times
+    the exact blob diameter; each keypoint is matched at most once. Returns
+    (exact index, approx index, distance) triples.
+    """
+    if not exact or not approx:
+        return []
+    exact_pts = np.array([k.pt for k in exact])
+    approx_pts = np.array([k.pt for k in approx])
+    distances = np.linalg.norm(exact_pts[:, None] - approx_pts[None], axis=2)
+    limits = np.array([k.size for k in exact])[:, None] * tolerance
+    candidates = np.argwhere(distances <= limits)
+    order = np.argsort(distances[candidates[:, 0], candidates[:, 1]])
+    matches = []
+    used_exact = set()
+    used_approx = set()
+    for i, j in candidates[order]:
+        if i in used_exact or j in used_approx:
+            continue
+        used_exact.add(i)
+        used_approx.add(j)
+        matches.append((int(i), int(j), float(distances[i, j])))
+    return matches
+
+
+def accuracy_report(
+    image_paths, scale, params=None, gaussian_blur_kernel_size=3, keep_unrefined=False
+):
+    """Compare coarse-to-fine detection at scale with the exact detector.
+
+    Returns a dict with recall and precision of the coarse keypoints against
+    the exact ones, the mean position and relative size error of matched
+    blobs, and the time taken by each mode.
+    """
+    exact_detector = BlobDetector()
+    coarse_detector = BlobDetector()
+    if params is not None:
+        exact_detector.set_params(params)
+        coarse_detector.set_params(params)
+    coarse_detector.coarse_scale = scale
+    coarse_detector.keep_unrefined = keep_unrefined
+
+    exact_count = coarse_count = 0
+    position_errors = []
+    size_errors = []
+    exact_seconds = coarse_seconds = 0.0
+    for image_path in image_paths:
+        image = Frame.load(image_path).bgr
+        start = time.perf_counter()
+        exact = exact_detector.detect_blobs(Frame(image), gaussian_blur_kernel_size)
+        exact_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        coarse = coarse_detector.detect_blobs_coarse_to_fine(
+            image, scale, gaussian_blur_kernel_size
+        )
+        coarse_seconds += time.perf_counter() - start
+
+        exact_count += len(exact)
+        coarse_count += len(coarse)
+        for i, j, distance in match_keypoints(exact, coarse):
+            position_errors.append(distance)
+            size_errors.append(abs(coarse[j].size - exact[i].size) / exact[i].size)
+
+    matched = len(position_errors)
+    return {
+        "images": len(image_paths),
+        "scale": scale,
+        "exact_blobs": exact_count,
+        "coarse_blobs": coarse_count,
+        "recall": matched / exact_count if exact_count else 1.0,
+        "precision": matched / coarse_count if coarse_count else 1.0,
+        "mean_position_error": float(np.mean(position_errors)) if matched else 0.0,
+        "mean_size_error": float(np.mean(size_errors)) if matched else 0.0,
+        "exact_seconds": exact_seconds,
+        "coarse_seconds": coarse_seconds,
+        "speedup": exact_seconds / coarse_seconds if coarse_seconds else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    from modules.blob_sweep import sample_images
+
+    parser = argparse.ArgumentParser(
+        description="Compare coarse-to-fine blob detection with the exact mode."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing the raw images"
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        action="append",
+        help="downsampling factor to evaluate, can be repeated (default 0.5)",
+    )
+    parser.add_argument("--sample", type=int, default=20, help="number of images")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--keep-unrefined",
+        action="store_true",
+        help="keep coarse blobs that are not found again at full resolution",
+    )
+    args = parser.parse_args()
+
+    mask_folder = os.path.join(args.workspace, "segmented_images", "masks")
+    image_paths = [
+        image_path
+        for image_path, _ in sample_images(
+            args.workspace, mask_folder, args.sample, args.seed
+        )
+    ]
+    if not image_paths:
+        parser.error("no segmented images found, parse the images first")
+    for scale in args.scale or [0.5]:
+        report = accuracy_report(image_paths, scale, keep_unrefined=args.keep_unrefined)
+        print(
+            f"scale {scale}: recall {report['recall']:.1%}, "
+            f"precision {report['precision']:.1%}, "
+            f"position error {report['mean_position_error']:.2f}px, "
+            f"size error {report['mean_size_error']:.1%}, "
+            f"{report['exact_seconds']:.2f}s -> {report['coarse_seconds']:.2f}s "
+            f"({report['speedup']:.1f}x) on {report['images']} images"
+        )
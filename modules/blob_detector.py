@@ -1,9 +1,13 @@
 import os
-import copy
+import multiprocessing
 import cv2
-import numpy as np
 import json
 
+from modules.frame import Frame
+from modules.mask_io import load_mask
+from modules.mask_store import MaskStore
+from modules.tracing import span, traced
+
 
 # hardcoded labels for face parsing model labels
 FACE_PARSING_LABELS = [
@@ -56,28 +60,145 @@ class BlobDetector:
 
         self.detector = cv2.SimpleBlobDetector_create(self.params)
 
+        # 1.0 detects on the full resolution image; below 1.0 detects on an
+        # image downsampled by that factor and refines each blob at full
+        # resolution, see detect_blobs_coarse_to_fine
+        self.coarse_scale = 1.0
+        # keep coarse blobs that are not found again at full resolution
+        self.keep_unrefined = False
+
     def set_params(self, params):
-        self.params = copy.deepcopy(params)
+        # Params objects cannot be deep-copied, copy them field by field
+        self.params = params_from_dict(params_to_dict(params))
         self.detector = cv2.SimpleBlobDetector_create(self.params)
 
+    @traced("blobs.detect_blobs")
     def detect_blobs(self, image_path, gaussian_blur_kernel_size=3):
-        image = cv2.imread(image_path)
-        blur_image = cv2.GaussianBlur(
-            image, (gaussian_blur_kernel_size, gaussian_blur_kernel_size), 0
+        """image_path is an image file, or a Frame that is already decoded."""
+        if isinstance(image_path, str):
+            with span("blobs.decode"):
+                image = Frame.load(image_path).bgr
+        else:
+            image = image_path.bgr
+        if self.coarse_scale < 1.0:
+            return self.detect_blobs_coarse_to_fine(
+                image, self.coarse_scale, gaussian_blur_kernel_size
+            )
+        with span("blobs.blur"):
+            blur_image = cv2.GaussianBlur(
+                image, (gaussian_blur_kernel_size, gaussian_blur_kernel_size), 0
+            )
+        with span("blobs.detect"):
+            keypoints = self.detector.detect(blur_image)
+
+        return keypoints
+
+    def detect_blobs_coarse_to_fine(
+        self, image, scale, gaussian_blur_kernel_size=3, window_factor=2.0
+    ):
+        """Detect on a downsampled image, then refine each blob at full resolution.
+
+        The threshold passes of SimpleBlobDetector run over scale**2 of the
+        pixels. Each coarse blob is then detected again in a window of about
+        window_factor times its diameter of the full resolution image, which
+        restores the exact position and size. A blob not found again in its
+        window is mostly one the full resolution filters reject (e.g. below
+        minArea, which only passes the coarse minArea * scale**2), so it is
+        dropped unless keep_unrefined is set, in which case it keeps its
+        upscaled coarse estimate.
+        """
+        with span("blobs.coarse_detect", scale=scale):
+            keypoints = self._detect_coarse(image, scale, gaussian_blur_kernel_size)
+        with span("blobs.refine", blobs=len(keypoints)):
+            return self._refine(
+                image, keypoints, scale, gaussian_blur_kernel_size, window_factor
+            )
+
+    def _detect_coarse(self, image, scale, gaussian_blur_kernel_size):
+        height, width = image.shape[:2]
+        small = cv2.resize(
+            image,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
         )
-        keypoints = self.detector.detect(blur_image)
+        small = cv2.GaussianBlur(
+            small, (gaussian_blur_kernel_size, gaussian_blur_kernel_size), 0
+        )
+        # areas and distances shrink with the image, the shape filters do not
+        coarse_params = params_from_dict(params_to_dict(self.params))
+        coarse_params.minArea = self.params.minArea * scale * scale
+        coarse_params.maxArea = self.params.maxArea * scale * scale
+        coarse_params.minDistBetweenBlobs = self.params.minDistBetweenBlobs * scale
+        return cv2.SimpleBlobDetector_create(coarse_params).detect(small)
 
+    def _refine(
+        self, image, coarse_keypoints, scale, gaussian_blur_kernel_size, window_factor
+    ):
+        height, width = image.shape[:2]
+        refine_params = params_from_dict(params_to_dict(self.params))
+        pad = gaussian_blur_kernel_size
+        keypoints = []
+        for coarse in coarse_keypoints:
+            x = coarse.pt[0] / scale
+            y = coarse.pt[1] / scale
+            size = coarse.size / scale
+            half = int(size * window_factor / 2) + pad + 2
+            x0, y0 = max(0, int(x) - half), max(0, int(y) - half)
+            x1, y1 = min(width, int(x) + half + 1), min(height, int(y) + half + 1)
+            window = cv2.GaussianBlur(
+                image[y0:y1, x0:x1],
+                (gaussian_blur_kernel_size, gaussian_blur_kernel_size),
+                0,
+            )
+            # at high thresholds the background of the window forms one dark
+            # region whose centre is grouped with the blob's; the full image
+            # is too large for maxArea, so cap it below the window area too
+            refine_params.maxArea = min(self.params.maxArea, (x1 - x0) * (y1 - y0) / 2)
+            refined = cv2.SimpleBlobDetector_create(refine_params).detect(window)
+            if refined:
+                # the window may also hold a neighbour, keep the closest blob
+                best = min(
+                    refined,
+                    key=lambda k: (k.pt[0] + x0 - x) ** 2 + (k.pt[1] + y0 - y) ** 2,
+                )
+                x, y, size = best.pt[0] + x0, best.pt[1] + y0, best.size
+            elif not self.keep_unrefined:
+                continue
+            keypoints.append(cv2.KeyPoint(x, y, size))
         return keypoints
 
+    @traced("blobs.draw_blobs")
     def draw_blobs(
         self, image_path, mask_path, keypoints, output_path, output_keypoints_path
     ):
-        image = cv2.imread(image_path)
+        """Draw and save the blobs with their face region; returns the blob dicts.
+
+        image_path is an image file or a Frame, mask_path is a mask file or an
+        already opened (e.g. memory-mapped) mask.
+        """
+        image, keypoints_json = self.render_blobs(image_path, mask_path, keypoints)
+        self.save_blobs(image, keypoints_json, output_path, output_keypoints_path)
+        return keypoints_json
+
+    @traced("blobs.render")
+    def render_blobs(self, image_path, mask_path, keypoints):
+        """Return (image with the blobs drawn, blob dicts) without writing files."""
+        if isinstance(image_path, str):
+            with span("blobs.decode"):
+                image = Frame.load(image_path).bgr
+        else:
+            # a Frame is shared with the other stages, draw on a copy
+            image = image_path.bgr.copy()
 
         skin_idx = FACE_PARSING_LABELS.index("skin")
         nose_idx = FACE_PARSING_LABELS.index("nose")
 
-        mask = np.load(mask_path)
+        # only the pixels under the keypoints are read from a memory-mapped mask
+        if isinstance(mask_path, str):
+            with span("blobs.load_mask"):
+                mask = load_mask(mask_path)
+        else:
+            mask = mask_path
 
         keypoints_json = []
 
@@ -132,10 +253,103 @@ class BlobDetector:
             1,
             cv2.LINE_AA,
         )
-        cv2.imwrite(output_path, image)
+        return image, keypoints_json
+
+    def save_blobs(self, image, keypoints_json, output_path, output_keypoints_path):
+        with span("blobs.save_image"):
+            cv2.imwrite(output_path, image)
 
-        with open(output_keypoints_path, "w") as f:
-            json.dump(keypoints_json, f)
+        with span("blobs.save_keypoints"):
+            with open(output_keypoints_path, "w") as f:
+                json.dump(keypoints_json, f)
+
+
+def params_to_dict(params):
+    """Plain dict copy of SimpleBlobDetector_Params, which cannot be pickled."""
+    return {
+        name: getattr(params, name) for name in dir(params) if not name.startswith("_")
+    }
+
+
+def params_from_dict(values):
+    params = cv2.SimpleBlobDetector_Params()
+    for name, value in values.items():
+        setattr(params, name, value)
+    return params
+
+
+# one detector (and mask store) per worker process, built by the pool initializer
+_worker_detector = None
+_worker_mask_store = None
+
+
+def _init_worker(params_values, mask_store_folder, coarse_scale):
+    global _worker_detector, _worker_mask_store
+    # each worker is single threaded, the pool provides the parallelism
+    cv2.setNumThreads(1)
+    _worker_detector = BlobDetector()
+    _worker_detector.set_params(params_from_dict(params_values))
+    _worker_detector.coarse_scale = coarse_scale
+    if mask_store_folder:
+        _worker_mask_store = MaskStore(mask_store_folder)
+
+
+def _detect_and_draw(job):
+    image_path = job[0]
+    # one unreadable image or mismatched mask must not end the whole run
+    try:
+        return image_path, _detect_and_draw_image(*job), None
+    except Exception as e:
+        return image_path, None, f"{type(e).__name__}: {e}"
+
+
+def _detect_and_draw_image(image_path, mask_path, output_path, output_keypoints_path):
+    # decoded once for both detecting and drawing
+    frame = Frame.load(image_path)
+    if not isinstance(mask_path, str):
+        # (image id in the workspace mask store, mask file); the file is read
+        # when the stored mask is stale or not the shape of the image
+        image_id, mask_path = mask_path
+        if _worker_mask_store.is_current(image_id, mask_path, frame.bgr.shape[:2]):
+            mask_path = _worker_mask_store.get(image_id)
+    keypoints = _worker_detector.detect_blobs(frame)
+    return _worker_detector.draw_blobs(
+        frame, mask_path, keypoints, output_path, output_keypoints_path
+    )
+
+
+def detect_blobs_parallel(
+    jobs,
+    params,
+    processes=None,
+    chunksize=4,
+    mask_store_folder=None,
+    coarse_scale=1.0,
+):
+    """Run detect_blobs + draw_blobs over many images in a process pool.
+
+    jobs is an iterable of (image_path, mask_path, output_path,
+    output_keypoints_path) tuples. With mask_store_folder set, mask_path may
+    instead be an (image id, mask path) pair, read from that MaskStore while
+    the stored mask is current, see MaskStore.is_current. coarse_scale is
+    BlobDetector.coarse_scale of the workers. Yields (image_path, blob
+    dicts, None) in completion order, or (image_path, None, error message)
+    for an image that failed; closing the generator terminates the pool.
+    """
+    # spawn keeps the workers free of the parent's Qt threads
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(
+        processes=processes,
+        initializer=_init_worker,
+        initargs=(params_to_dict(params), mask_store_folder, coarse_scale),
+    )
+    try:
+        for result in pool.imap_unordered(_detect_and_draw, jobs, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 if __name__ == "__main__":
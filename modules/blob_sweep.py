@@ -0,0 +1,254 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from modules.blob_detector import (
+    FACE_PARSING_LABELS,
+    BlobDetector,
+    params_from_dict,
+    params_to_dict,
+)
+from modules.frame import Frame
+from modules.mask_io import load_mask
+from modules.workspace import existing_mask_path, get_image_paths
+
+# swept like a detector field, but applied before detection
+BLUR_KERNEL = "gaussian_blur_kernel_size"
+DEFAULT_BLUR_KERNEL = 3
+
+
+def grid_settings(space):
+    """Every combination of a {field: [values]} search space."""
+    fields = sorted(space)
+    for values in itertools.product(*(space[field] for field in fields)):
+        yield dict(zip(fields, values))
+
+
+def random_settings(space, count, seed=0):
+    """count random settings; a (low, high) tuple is sampled as a range.
+
+    A range of ints gives ints, blur kernel sizes are rounded up to odd.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        setting = {}
+        for field in sorted(space):
+            values = space[field]
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    value = rng.randint(low, high)
+                else:
+                    value = rng.uniform(low, high)
+            else:
+                value = rng.choice(values)
+            if field == BLUR_KERNEL:
+                value = int(value) | 1
+            setting[field] = value
+        yield setting
+
+
+def sample_images(workspace_path, mask_folder, sample_size=None, seed=0):
+    """Return (image path, mask path) of a random sample of segmented images."""
+    pairs = []
+    for image_path in get_image_paths(workspace_path):
+        mask_path = existing_mask_path(mask_folder, image_path)
+        if mask_path is not None:
+            pairs.append((image_path, mask_path))
+    if sample_size is not None and sample_size < len(pairs):
+        pairs = sorted(random.Random(seed).sample(pairs, sample_size))
+    return pairs
+
+
+def cache_inputs(pairs, blur_kernels, cache_dir):
+    """Write each image's blurred grayscale versions and mask as .npy files.
+
+    Every combination reads these back memory-mapped, so an image is decoded
+    and blurred once per kernel size for the whole sweep instead of once
+    per combination. Returns the cached paths, one dict per image.
+    """
+    inputs = []
+    for index, (image_path, mask_path) in enumerate(pairs):
+        image = Frame.load(image_path).bgr
+        cached = {"mask": os.path.join(cache_dir, f"{index}_mask.npy")}
+        np.save(cached["mask"], load_mask(mask_path))
+        for kernel in blur_kernels:
+            # same order as detect_blobs: blur the colour image, the detector
+            # then converts it to grayscale
+            blurred = cv2.GaussianBlur(image, (kernel, kernel), 0)
+            cached[kernel] = os.path.join(cache_dir, f"{index}_blur{kernel}.npy")
+            np.save(cached[kernel], cv2.cvtColor(blurred, cv2.COLOR_BGR2GRAY))
+        inputs.append(cached)
+    return inputs
+
+
+# cached inputs of the sweep, handed to each worker by the pool initializer
+_worker_inputs = None
+
+
+def _init_worker(inputs):
+    global _worker_inputs
+    cv2.setNumThreads(1)
+    _worker_inputs = inputs
+
+
+def _evaluate(job):
+    """Count the blobs of every face region for one setting over all images."""
+    index, params_values, kernel = job
+    start = time.perf_counter()
+    detector = cv2.SimpleBlobDetector_create(params_from_dict(params_values))
+    counts = np.zeros(len(FACE_PARSING_LABELS), dtype=np.int64)
+    for cached in _worker_inputs:
+        gray = np.load(cached[kernel], mmap_mode="r")
+        mask = np.load(cached["mask"], mmap_mode="r")
+        keypoints = detector.detect(np.ascontiguousarray(gray))
+        if keypoints:
+            xs = [int(keypoint.pt[0]) for keypoint in keypoints]
+            ys = [int(keypoint.pt[1]) for keypoint in keypoints]
+            counts += np.bincount(mask[ys, xs], minlength=len(FACE_PARSING_LABELS))
+    return index, counts, time.perf_counter() - start
+
+
+def run_sweep(pairs, settings, base_params=None, processes=None):
+    """Evaluate every setting over the images in a process pool.
+
+    settings is an iterable of {field: value} dicts over SimpleBlobDetector
+    params fields and BLUR_KERNEL; unset fields keep base_params. Yields
+    (setting, full params dict, blur kernel, counts per FACE_PARSING_LABELS
+    region, seconds) in completion order.
+    """
+    base_values = params_to_dict(base_params or BlobDetector().params)
+    jobs = []
+    settings = list(settings)
+    for index, setting in enumerate(settings):
+        unknown = set(setting) - set(base_values) - {BLUR_KERNEL}
+        if unknown:
+            raise ValueError(f"unknown blob detector fields {sorted(unknown)}")
+        params_values = dict(base_values)
+        params_values.update(
+            (field, value) for field, value in setting.items() if field != BLUR_KERNEL
+        )
+        jobs.append(
+            (index, params_values, setting.get(BLUR_KERNEL, DEFAULT_BLUR_KERNEL))
+        )
+
+    cache_dir = tempfile.mkdtemp(prefix="blob-sweep-")
+    context = multiprocessing.get_context("spawn")
+    pool = None
+    try:
+        inputs = cache_inputs(
+            pairs, sorted({kernel for _, _, kernel in jobs}), cache_dir
+        )
+        pool = context.Pool(
+            processes=processes, initializer=_init_worker, initargs=(inputs,)
+        )
+        for index, counts, seconds in pool.imap_unordered(_evaluate, jobs):
+            _, params_values, kernel = jobs[index]
+            yield settings[index], params_values, kernel, counts, seconds
+        pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def parse_value(text):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    raise argparse.ArgumentTypeError(f"not a number or boolean: {text}")
+
+
+def parse_space(specs):
+    """Parse field=v1,v2,... (grid values) and field=low:high (random range)."""
+    space = {}
+    for spec in specs:
+        field, _, values = spec.partition("=")
+        if ":" in values:
+            low, high = values.split(":")
+            space[field] = (parse_value(low), parse_value(high))
+        else:
+            space[field] = [parse_value(value) for value in values.split(",")]
+    return space
+
+
+if __name__ == "__main__":
+    from modules.database import LabelDatabase
+
+    parser = argparse.ArgumentParser(
+        description="Sweep SimpleBlobDetector params over a sample of a workspace "
+        "and store the blob counts per face region in labels.db."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing the raw images"
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="FIELD=VALUES",
+        help="e.g. minArea=50,100,200 or minThreshold=20:80 (random search range); "
+        f"{BLUR_KERNEL} sets the blur before detection",
+    )
+    parser.add_argument(
+        "--random",
+        type=int,
+        metavar="N",
+        help="evaluate N random settings instead of the full grid",
+    )
+    parser.add_argument("--sample", type=int, help="number of images to evaluate on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, help="worker processes")
+    args = parser.parse_args()
+
+    space = parse_space(args.param)
+    if args.random:
+        settings = list(random_settings(space, args.random, args.seed))
+    elif any(isinstance(values, tuple) for values in space.values()):
+        parser.error("ranges (low:high) need --random")
+    else:
+        settings = list(grid_settings(space))
+
+    mask_folder = os.path.join(args.workspace, "segmented_images", "masks")
+    pairs = sample_images(args.workspace, mask_folder, args.sample, args.seed)
+    if not pairs:
+        parser.error("no segmented images found, parse the images first")
+
+    db = LabelDatabase(os.path.join(args.workspace, "labels.db"))
+    start = time.perf_counter()
+    sweep_id = db.add_blob_sweep(space, len(pairs))
+    results = []
+    done = 0
+    try:
+        for done, (setting, params_values, kernel, counts, _) in enumerate(
+            run_sweep(pairs, settings, processes=args.processes), 1
+        ):
+            params_id = db.blob_params_id(params_values)
+            results.extend(
+                (params_id, kernel, label, int(count))
+                for label, count in zip(FACE_PARSING_LABELS, counts)
+            )
+            print(
+                f"[{done}/{len(settings)}] {setting}: {int(counts.sum())} blobs",
+                flush=True,
+            )
+    finally:
+        db.add_blob_sweep_results(sweep_id, results)
+        db.close()
+    print(
+        f"Sweep {sweep_id}: {done} settings on {len(pairs)} images "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
@@ -0,0 +1,317 @@
+import fnmatch
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QSize, Qt, Signal
+from PySide6.QtGui import QPixmap
+from PySide6.QtWidgets import (
+    QAbstractItemView,
+    QComboBox,
+    QDialog,
+    QDialogButtonBox,
+    QFormLayout,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QListView,
+    QPushButton,
+    QSpinBox,
+    QVBoxLayout,
+)
+
+from modules.image_cache import load_image
+
+# what a bulk labeling operation applies to, see select_images
+SCOPE_RANGE = "Images from ... to ..."
+SCOPE_NAME = "File names matching"
+SCOPE_WITH_LABEL = "Images with label"
+SCOPE_WITHOUT_LABEL = "Images without label"
+SCOPE_UNLABELLED = "Images without any label"
+SCOPES = (
+    SCOPE_RANGE,
+    SCOPE_NAME,
+    SCOPE_WITH_LABEL,
+    SCOPE_WITHOUT_LABEL,
+    SCOPE_UNLABELLED,
+)
+THUMBNAIL_SIZE = QSize(160, 120)
+# thumbnails kept in memory, about 75 kB each; scrolled-away ones are dropped
+MAX_THUMBNAILS = 2000
+
+
+def select_images(
+    image_paths, label_index, scope, first=1, last=1, pattern="", label_id=None
+):
+    """Return the image paths a bulk operation applies to, in display order.
+
+    first and last are 1-based positions in image_paths (inclusive), pattern
+    is a shell-style pattern matched against the file names. Everything is
+    answered from the in-memory label index, no query is made.
+    """
+    if scope == SCOPE_RANGE:
+        first, last = sorted((first, last))
+        return image_paths[max(first, 1) - 1 : last]
+    if scope == SCOPE_NAME:
+        pattern = pattern or "*"
+        return [
+            image_path
+            for image_path in image_paths
+            if fnmatch.fnmatch(os.path.basename(image_path), pattern)
+        ]
+
+    def labels_of(image_path):
+        image_id = label_index.image_ids.get(image_path)
+        return label_index.image_labels.get(image_id, ())
+
+    if scope == SCOPE_WITH_LABEL:
+        return [path for path in image_paths if label_id in labels_of(path)]
+    if scope == SCOPE_WITHOUT_LABEL:
+        return [path for path in image_paths if label_id not in labels_of(path)]
+    if scope == SCOPE_UNLABELLED:
+        return [path for path in image_paths if not labels_of(path)]
+    raise ValueError(f"unknown scope {scope!r}")
+
+
+def _label_combo(label_names):
+    combo = QComboBox()
+    for label_id in sorted(label_names):
+        combo.addItem(label_names[label_id], label_id)
+    return combo
+
+
+class BulkLabelDialog(QDialog):
+    """Ask which label to add or remove, and on which images."""
+
+    def __init__(self, label_names, image_count, current_index=0, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Bulk Label Images")
+
+        self.labelCombo = _label_combo(label_names)
+        self.actionCombo = QComboBox()
+        self.actionCombo.addItems(["Add label", "Remove label"])
+        self.scopeCombo = QComboBox()
+        self.scopeCombo.addItems(SCOPES)
+        self.firstSpin = QSpinBox()
+        self.lastSpin = QSpinBox()
+        for spin in (self.firstSpin, self.lastSpin):
+            spin.setRange(1, max(image_count, 1))
+            spin.setValue(current_index + 1)
+        self.patternEdit = QLineEdit()
+        self.patternEdit.setPlaceholderText("e.g. *_2024*.jpg")
+        self.filterLabelCombo = _label_combo(label_names)
+
+        form = QFormLayout(self)
+        form.addRow("Label:", self.labelCombo)
+        form.addRow("Action:", self.actionCombo)
+        form.addRow("Apply to:", self.scopeCombo)
+        form.addRow("From image:", self.firstSpin)
+        form.addRow("To image:", self.lastSpin)
+        form.addRow("File name pattern:", self.patternEdit)
+        form.addRow("Filter label:", self.filterLabelCombo)
+        buttons = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        form.addRow(buttons)
+        self.form = form
+
+        self.scopeCombo.currentTextChanged.connect(self.update_fields)
+        self.update_fields(self.scopeCombo.currentText())
+
+    def update_fields(self, scope):
+        """Show only the inputs the chosen scope uses."""
+        for widget, scopes in (
+            (self.firstSpin, (SCOPE_RANGE,)),
+            (self.lastSpin, (SCOPE_RANGE,)),
+            (self.patternEdit, (SCOPE_NAME,)),
+            (self.filterLabelCombo, (SCOPE_WITH_LABEL, SCOPE_WITHOUT_LABEL)),
+        ):
+            self.form.setRowVisible(widget, scope in scopes)
+
+    def label_id(self):
+        return self.labelCombo.currentData()
+
+    def enabled(self):
+        """True to add the label, False to remove it."""
+        return self.actionCombo.currentIndex() == 0
+
+    def select(self, image_paths, label_index):
+        return select_images(
+            image_paths,
+            label_index,
+            self.scopeCombo.currentText(),
+            self.firstSpin.value(),
+            self.lastSpin.value(),
+            self.patternEdit.text().strip(),
+            self.filterLabelCombo.currentData(),
+        )
+
+
+class ThumbnailModel(QAbstractListModel):
+    """Image paths with thumbnails decoded in the background on first display.
+
+    Only the rows the view paints ask for their thumbnail, so opening the
+    view on a large workspace decodes a screenful of images, not all of them.
+    loader(image_path, max_size) returns a QImage, e.g. PyramidCache.load.
+    """
+
+    thumbnail_ready = Signal(str, object)  # image path, QImage
+
+    def __init__(self, image_paths, describe=None, loader=load_image, parent=None):
+        super().__init__(parent)
+        self.image_paths = list(image_paths)
+        self.rows = {path: row for row, path in enumerate(self.image_paths)}
+        # describe(image_path) -> tooltip text, e.g. the labels of the image
+        self.describe = describe
+        self.loader = loader
+        # image path -> QPixmap, least recently shown first
+        self.thumbnails = OrderedDict()
+        # only touched on the GUI thread, the workers just decode
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="thumbnails"
+        )
+        # emitted from the worker threads, delivered on the GUI thread
+        self.thumbnail_ready.connect(self._on_thumbnail_ready)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.image_paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        image_path = self.image_paths[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{index.row() + 1}. {os.path.basename(image_path)}"
+        if role == Qt.ItemDataRole.DecorationRole:
+            thumbnail = self.thumbnails.get(image_path)
+            if thumbnail is None:
+                self._request(image_path)
+            else:
+                self.thumbnails.move_to_end(image_path)
+            return thumbnail
+        if role == Qt.ItemDataRole.ToolTipRole and self.describe is not None:
+            return self.describe(image_path)
+        if role == Qt.ItemDataRole.UserRole:
+            return image_path
+        return None
+
+    def refresh(self):
+        """Re-read tooltips and labels of every row, e.g. after bulk labeling."""
+        if self.image_paths:
+            self.dataChanged.emit(self.index(0), self.index(len(self.image_paths) - 1))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _request(self, image_path):
+        if image_path in self._pending:
+            return
+        self._pending.add(image_path)
+        self._executor.submit(self._decode, image_path)
+
+    def _decode(self, image_path):
+        image = self.loader(image_path, THUMBNAIL_SIZE)
+        if not image.isNull():
+            image = image.scaled(
+                THUMBNAIL_SIZE,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+        self.thumbnail_ready.emit(image_path, image)
+
+    def _on_thumbnail_ready(self, image_path, image):
+        # QPixmap must be made on the GUI thread
+        self._pending.discard(image_path)
+        self.thumbnails[image_path] = QPixmap.fromImage(image)
+        while len(self.thumbnails) > MAX_THUMBNAILS:
+            self.thumbnails.popitem(last=False)
+        row = self.rows.get(image_path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+
+class ThumbnailDialog(QDialog):
+    """Grid of the workspace images; the selection can be labeled in one go.
+
+    Ctrl/Shift-click selects several images, double-click opens an image in
+    the main window.
+    """
+
+    label_requested = Signal(list, int, bool)  # image paths, label id, add
+    image_activated = Signal(str)  # image path
+
+    def __init__(
+        self, image_paths, label_names, describe=None, loader=load_image, parent=None
+    ):
+        super().__init__(parent)
+        self.setWindowTitle("Thumbnails")
+        self.resize(900, 650)
+
+        self.model = ThumbnailModel(image_paths, describe, loader, self)
+        self.view = QListView()
+        self.view.setViewMode(QListView.ViewMode.IconMode)
+        self.view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.view.setMovement(QListView.Movement.Static)
+        self.view.setUniformItemSizes(True)
+        # lays out large workspaces in batches instead of all at once
+        self.view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.view.setIconSize(THUMBNAIL_SIZE)
+        self.view.setGridSize(
+            QSize(THUMBNAIL_SIZE.width() + 20, THUMBNAIL_SIZE.height() + 30)
+        )
+        self.view.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.view.setModel(self.model)
+        self.view.doubleClicked.connect(
+            lambda index: self.image_activated.emit(
+                index.data(Qt.ItemDataRole.UserRole)
+            )
+        )
+        self.view.selectionModel().selectionChanged.connect(self.update_status)
+
+        self.labelCombo = _label_combo(label_names)
+        self.addButton = QPushButton("Add label")
+        self.removeButton = QPushButton("Remove label")
+        self.addButton.clicked.connect(lambda: self.request_label(True))
+        self.removeButton.clicked.connect(lambda: self.request_label(False))
+        self.status = QLabel()
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.status, 1)
+        controls.addWidget(self.labelCombo)
+        controls.addWidget(self.addButton)
+        controls.addWidget(self.removeButton)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.view)
+        layout.addLayout(controls)
+        self.update_status()
+
+    def selected_paths(self):
+        rows = sorted(
+            index.row() for index in self.view.selectionModel().selectedIndexes()
+        )
+        return [self.model.image_paths[row] for row in rows]
+
+    def update_status(self):
+        count = len(self.view.selectionModel().selectedIndexes())
+        self.status.setText(f"{count} of {self.model.rowCount()} images selected")
+
+    def request_label(self, enabled):
+        label_id = self.labelCombo.currentData()
+        image_paths = self.selected_paths()
+        if label_id is None or not image_paths:
+            return
+        self.label_requested.emit(image_paths, label_id, enabled)
+        self.model.refresh()
+
+    def select_row(self, row):
+        index = self.model.index(row)
+        self.view.setCurrentIndex(index)
+        self.view.scrollTo(index)
+
+    def done(self, result):
+        self.model.shutdown()
+        super().done(result)
@@ -0,0 +1,391 @@
+import json
+import os
+import sqlite3
+import time
+
+from modules.schema import migrate
+from modules.tracing import traced
+
+
+class LabelDatabase:
+    """Long-lived connection to a workspace labels.db.
+
+    The connection is opened once per workspace instead of once per query.
+    Every statement below is a constant SQL string, so the sqlite3 statement
+    cache hands back the already prepared statement on each call. Each query
+    method is timed as a db.<method> span while tracing is enabled.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, cached_statements=256)
+        # WAL lets a commit append to the log instead of rewriting pages, and
+        # with synchronous=NORMAL it only fsyncs on checkpoints
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # negative cache_size is in KiB, keep up to 64 MB of pages in memory
+        self.conn.execute("PRAGMA cache_size=-65536")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        # brings databases of older versions up to date, and enables the
+        # foreign keys that cascade deletes to dependent rows
+        migrate(self.conn)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    @staticmethod
+    def remove(db_path):
+        """Delete a database file together with its WAL side files."""
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # images
+
+    @traced("db.image_count")
+    def image_count(self):
+        return self.conn.execute("SELECT count(*) FROM images").fetchone()[0]
+
+    @traced("db.image_ids")
+    def image_ids(self):
+        """Return (image_path, id) for every image."""
+        return self.conn.execute("SELECT image_path, id FROM images").fetchall()
+
+    @traced("db.image_id")
+    def image_id(self, image_path):
+        row = self.conn.execute(
+            "SELECT id FROM images WHERE image_path=?", (image_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    @traced("db.sync_images")
+    def sync_images(self, image_paths):
+        """Make the images table match image_paths in one set-based transaction.
+
+        image_paths may be any iterable, e.g. a streamed directory listing. New
+        images get ids in iteration order; removed images are deleted and the
+        foreign keys delete their labels and blobs. Returns a dict with the
+        added/removed/orphaned label counts and the elapsed seconds.
+        """
+        start = time.perf_counter()
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS workspace_images (
+                    image_path TEXT NOT NULL UNIQUE
+                )
+                """
+            )
+            self.conn.execute("DELETE FROM temp.workspace_images")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO temp.workspace_images (image_path) VALUES (?)",
+                ((image_path,) for image_path in image_paths),
+            )
+            # both NOT EXISTS lookups are answered by the UNIQUE indexes
+            added = self.conn.execute(
+                """
+                INSERT INTO images (image_path)
+                SELECT w.image_path FROM temp.workspace_images AS w
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM images WHERE images.image_path = w.image_path
+                )
+                ORDER BY w.rowid
+                """
+            ).rowcount
+            gone = """
+                SELECT id FROM images
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM temp.workspace_images AS w
+                    WHERE w.image_path = images.image_path
+                )
+                """
+            # counted before the delete cascades to their labels and blobs
+            orphans = self.conn.execute(
+                f"SELECT count(*) FROM image_labels WHERE image_id IN ({gone})"
+            ).fetchone()[0]
+            removed = self.conn.execute(
+                f"DELETE FROM images WHERE id IN ({gone})"
+            ).rowcount
+            self.conn.execute("DELETE FROM temp.workspace_images")
+        return {
+            "added": added,
+            "removed": removed,
+            "orphaned_labels": orphans,
+            "seconds": time.perf_counter() - start,
+        }
+
+    # labels
+
+    @traced("db.labels")
+    def labels(self):
+        """Return (id, label_name, key_binding) for every label."""
+        return self.conn.execute(
+            "SELECT id, label_name, key_binding FROM labels"
+        ).fetchall()
+
+    @traced("db.key_binding_exists")
+    def key_binding_exists(self, key_binding):
+        row = self.conn.execute(
+            "SELECT count(*) FROM labels WHERE key_binding_upper=upper(?)",
+            (key_binding,),
+        ).fetchone()
+        return row[0] > 0
+
+    @traced("db.add_label")
+    def add_label(self, label_name, key_binding):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO labels (label_name, key_binding) VALUES (?, ?)",
+                (label_name, key_binding),
+            )
+        return cursor.lastrowid
+
+    @traced("db.remove_label")
+    def remove_label(self, label_id):
+        """Remove a label; its image assignments are deleted by the foreign key."""
+        with self.conn:
+            self.conn.execute("DELETE FROM labels WHERE id=?", (label_id,))
+
+    # image labels
+
+    @traced("db.image_label_pairs")
+    def image_label_pairs(self):
+        """Return (image_id, label_id) for every label assignment."""
+        return self.conn.execute(
+            "SELECT image_id, label_id FROM image_labels"
+        ).fetchall()
+
+    @traced("db.add_image_label")
+    def add_image_label(self, image_id, label_id):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO image_labels (image_id, label_id) VALUES (?, ?)",
+                (image_id, label_id),
+            )
+
+    @traced("db.remove_image_label")
+    def remove_image_label(self, image_id, label_id):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM image_labels WHERE image_id=? AND label_id=?",
+                (image_id, label_id),
+            )
+
+    @traced("db.toggle_label")
+    def toggle_label(self, image_id, label_id):
+        """Add the label to the image, or remove it if already set.
+
+        Returns True if the label is now set on the image.
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM image_labels WHERE image_id=? AND label_id=?",
+                (image_id, label_id),
+            )
+            if cursor.rowcount > 0:
+                return False
+            self.conn.execute(
+                "INSERT INTO image_labels (image_id, label_id) VALUES (?, ?)",
+                (image_id, label_id),
+            )
+        return True
+
+    @traced("db.set_label_for_images")
+    def set_label_for_images(self, image_ids, label_id, enabled):
+        """Add (or remove) one label on many images in one transaction.
+
+        The ids go to a temp table and a single INSERT OR IGNORE ... SELECT
+        or DELETE applies the change to all of them, instead of one statement
+        per image. Returns the number of images whose labels changed.
+        """
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS selected_images (
+                    image_id INTEGER PRIMARY KEY
+                )
+                """
+            )
+            self.conn.execute("DELETE FROM temp.selected_images")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO temp.selected_images (image_id) VALUES (?)",
+                ((image_id,) for image_id in image_ids),
+            )
+            if enabled:
+                changed = self.conn.execute(
+                    """
+                    INSERT OR IGNORE INTO image_labels (image_id, label_id)
+                    SELECT s.image_id, ? FROM temp.selected_images AS s
+                    WHERE EXISTS (SELECT 1 FROM images WHERE images.id = s.image_id)
+                    """,
+                    (label_id,),
+                ).rowcount
+            else:
+                changed = self.conn.execute(
+                    """
+                    DELETE FROM image_labels
+                    WHERE label_id = ?
+                    AND image_id IN (SELECT image_id FROM temp.selected_images)
+                    """,
+                    (label_id,),
+                ).rowcount
+            self.conn.execute("DELETE FROM temp.selected_images")
+        return changed
+
+    @traced("db.labels_for_image")
+    def labels_for_image(self, image_id):
+        """Return the names of the labels set on an image."""
+        rows = self.conn.execute(
+            """
+            SELECT label_name
+            FROM labels
+            JOIN image_labels ON labels.id = image_labels.label_id
+            WHERE image_labels.image_id = ?
+            """,
+            (image_id,),
+        )
+        return [label_name for (label_name,) in rows]
+
+    # blobs
+
+    @traced("db.blob_params_id")
+    def blob_params_id(self, params):
+        """Return the id of a detector params dict, adding it if it is new."""
+        params_json = json.dumps(params, sort_keys=True)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO blob_params (params) VALUES (?)", (params_json,)
+            )
+        return self.conn.execute(
+            "SELECT id FROM blob_params WHERE params=?", (params_json,)
+        ).fetchone()[0]
+
+    @traced("db.replace_blobs")
+    def replace_blobs(self, image_blobs, params_id=None):
+        """Store blob results in one transaction.
+
+        image_blobs is an iterable of (image_id, blobs), blobs being the
+        {"x", "y", "size", "label"} dicts written by BlobDetector.draw_blobs.
+        Earlier blobs of those images with the same params id are replaced.
+        Returns the number of blobs stored.
+        """
+        stored = 0
+        with self.conn:
+            for image_id, blobs in image_blobs:
+                self.conn.execute(
+                    "DELETE FROM blobs WHERE image_id=? AND params_id IS ?",
+                    (image_id, params_id),
+                )
+                self.conn.executemany(
+                    """
+                    INSERT INTO blobs (image_id, x, y, size, label, params_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        (image_id, b["x"], b["y"], b["size"], b["label"], params_id)
+                        for b in blobs
+                    ),
+                )
+                stored += len(blobs)
+        return stored
+
+    @traced("db.query_blobs")
+    def query_blobs(
+        self,
+        label=None,
+        min_size=None,
+        max_size=None,
+        region=None,
+        image_id=None,
+        params_id=None,
+    ):
+        """Return (image_path, x, y, size, label) of the blobs matching every filter.
+
+        region is an (x0, y0, x1, y1) box in image pixels; blobs overlapping
+        it are found through the R*Tree index.
+        """
+        conditions = []
+        args = []
+        if region is not None:
+            x0, y0, x1, y1 = region
+            conditions.append(
+                "blobs.id IN (SELECT id FROM blobs_rtree "
+                "WHERE max_x >= ? AND min_x <= ? AND max_y >= ? AND min_y <= ?)"
+            )
+            args += [x0, x1, y0, y1]
+        for condition, value in (
+            ("blobs.label = ?", label),
+            ("blobs.size >= ?", min_size),
+            ("blobs.size <= ?", max_size),
+            ("blobs.image_id = ?", image_id),
+            ("blobs.params_id = ?", params_id),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                args.append(value)
+        where = " AND ".join(conditions) or "1"
+        return self.conn.execute(
+            f"""
+            SELECT images.image_path, blobs.x, blobs.y, blobs.size, blobs.label
+            FROM blobs JOIN images ON images.id = blobs.image_id
+            WHERE {where}
+            ORDER BY blobs.image_id, blobs.id
+            """,
+            args,
+        ).fetchall()
+
+    @traced("db.blob_stats")
+    def blob_stats(self, params_id=None):
+        """Return (label, blob count, image count, mean size, max size) per label."""
+        return self.conn.execute(
+            """
+            SELECT label, count(*), count(DISTINCT image_id), avg(size), max(size)
+            FROM blobs
+            WHERE ?1 IS NULL OR params_id = ?1
+            GROUP BY label
+            ORDER BY count(*) DESC
+            """,
+            (params_id,),
+        ).fetchall()
+
+    @traced("db.add_blob_sweep")
+    def add_blob_sweep(self, search_space, image_count):
+        """Record a parameter sweep and return its id."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO blob_sweeps (search_space, image_count) VALUES (?, ?)",
+                (json.dumps(search_space, sort_keys=True), image_count),
+            )
+        return cursor.lastrowid
+
+    @traced("db.add_blob_sweep_results")
+    def add_blob_sweep_results(self, sweep_id, rows):
+        """Store (params_id, blur kernel, label, blob count) rows of a sweep."""
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO blob_sweep_results
+                    (sweep_id, params_id, blur_kernel, label, blob_count)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    (sweep_id, params_id, kernel, label, count)
+                    for params_id, kernel, label, count in rows
+                ),
+            )
+
+    @traced("db.blob_sweep_results")
+    def blob_sweep_results(self, sweep_id):
+        """Return (params JSON, blur kernel, label, blob count) rows of a sweep."""
+        return self.conn.execute(
+            """
+            SELECT blob_params.params, r.blur_kernel, r.label, r.blob_count
+            FROM blob_sweep_results AS r
+            JOIN blob_params ON blob_params.id = r.params_id
+            WHERE r.sweep_id = ?
+            ORDER BY r.params_id, r.blur_kernel, r.label
+            """,
+            (sweep_id,),
+        ).fetchall()
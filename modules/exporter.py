@@ -0,0 +1,393 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import pathlib
+import sqlite3
+import time
+
+EXPORT_FORMATS = ("csv", "jsonl", "coco")
+# rows fetched from sqlite at a time; memory does not grow with the table size
+CHUNK_SIZE = 10000
+
+
+def export_format_for(output_path):
+    """Guess the export format from the output file extension."""
+    extension = os.path.splitext(output_path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".json": "coco"}.get(extension)
+
+
+def open_readonly(db_path):
+    """Read-only connection, so an export never blocks the app's writes (WAL)."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"database not found: {db_path}")
+    uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def iter_rows(cursor, chunk_size=CHUNK_SIZE):
+    """Yield the rows of an executed cursor, chunk_size rows in memory at a time."""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def has_blobs_table(conn):
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='blobs'"
+        ).fetchone()
+        is not None
+    )
+
+
+def label_ids_for(conn, label_names):
+    """Ids of the named labels; raises ValueError for an unknown name."""
+    label_ids = []
+    for label_name in label_names:
+        rows = conn.execute(
+            "SELECT id FROM labels WHERE label_name=?", (label_name,)
+        ).fetchall()
+        if not rows:
+            raise ValueError(f"unknown label {label_name!r}")
+        label_ids += [label_id for (label_id,) in rows]
+    return label_ids
+
+
+class _Filter:
+    """SQL of the optional label filter, shared by the export queries."""
+
+    def __init__(self, label_ids):
+        self.label_ids = list(label_ids or [])
+        placeholders = ",".join("?" * len(self.label_ids))
+        if self.label_ids:
+            self.images = (
+                "WHERE EXISTS (SELECT 1 FROM image_labels AS il "
+                f"WHERE il.image_id = images.id AND il.label_id IN ({placeholders}))"
+            )
+            self.image_labels = f"WHERE image_labels.label_id IN ({placeholders})"
+            self.blobs = (
+                "WHERE EXISTS (SELECT 1 FROM image_labels AS il "
+                f"WHERE il.image_id = blobs.image_id AND il.label_id IN ({placeholders}))"
+            )
+        else:
+            self.images = self.image_labels = self.blobs = ""
+
+
+def iter_images(conn, label_filter, chunk_size=CHUNK_SIZE):
+    """Yield (image id, image path) in id order."""
+    cursor = conn.execute(
+        f"SELECT id, image_path FROM images {label_filter.images} ORDER BY id",
+        label_filter.label_ids,
+    )
+    return iter_rows(cursor, chunk_size)
+
+
+def iter_image_records(conn, label_filter, include_blobs, chunk_size=CHUNK_SIZE):
+    """Yield (image id, image path, [(label id, label name)], [blob rows]).
+
+    The images, their labels and their blobs are read by three cursors
+    sorted by image id and merged, so only one image's rows are held at a
+    time. Blob rows are (x, y, size, face region, params id).
+    """
+    label_rows = iter_rows(
+        conn.execute(
+            f"""
+            SELECT image_labels.image_id, labels.id, labels.label_name
+            FROM image_labels JOIN labels ON labels.id = image_labels.label_id
+            {label_filter.image_labels}
+            ORDER BY image_labels.image_id, labels.id
+            """,
+            label_filter.label_ids,
+        ),
+        chunk_size,
+    )
+    labels_by_image = itertools.groupby(label_rows, key=lambda row: row[0])
+    blobs_by_image = iter(())
+    if include_blobs:
+        blob_rows = iter_rows(
+            conn.execute(
+                f"""
+                SELECT image_id, x, y, size, label, params_id FROM blobs
+                {label_filter.blobs}
+                ORDER BY image_id
+                """,
+                label_filter.label_ids,
+            ),
+            chunk_size,
+        )
+        blobs_by_image = itertools.groupby(blob_rows, key=lambda row: row[0])
+
+    next_labels = next(labels_by_image, None)
+    next_blobs = next(blobs_by_image, None)
+    for image_id, image_path in iter_images(conn, label_filter, chunk_size):
+        labels = []
+        # rows of images no longer in the images table are skipped
+        while next_labels is not None and next_labels[0] <= image_id:
+            if next_labels[0] == image_id:
+                labels = [row[1:] for row in next_labels[1]]
+            next_labels = next(labels_by_image, None)
+        blobs = []
+        while next_blobs is not None and next_blobs[0] <= image_id:
+            if next_blobs[0] == image_id:
+                blobs = [row[1:] for row in next_blobs[1]]
+            next_blobs = next(blobs_by_image, None)
+        yield image_id, image_path, labels, blobs
+
+
+def write_csv(records, output_path, blobs_path=None):
+    """One row per image label, unlabelled images get one row without a label.
+
+    Blobs go to blobs_path, one row per blob, when it is given.
+    """
+    counts = {"images": 0, "labels": 0, "blobs": 0}
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_id", "image_path", "label_id", "label_name"])
+        blobs_file = blob_writer = None
+        if blobs_path:
+            blobs_file = open(blobs_path, "w", newline="")
+            blob_writer = csv.writer(blobs_file)
+            blob_writer.writerow(
+                ["image_id", "image_path", "x", "y", "size", "region", "params_id"]
+            )
+        try:
+            for image_id, image_path, labels, blobs in records:
+                counts["images"] += 1
+                if labels:
+                    writer.writerows(
+                        (image_id, image_path, label_id, label_name)
+                        for label_id, label_name in labels
+                    )
+                    counts["labels"] += len(labels)
+                else:
+                    writer.writerow((image_id, image_path, "", ""))
+                if blob_writer is not None:
+                    blob_writer.writerows((image_id, image_path) + b for b in blobs)
+                    counts["blobs"] += len(blobs)
+                yield counts
+        finally:
+            if blobs_file is not None:
+                blobs_file.close()
+
+
+def _blob_dict(blob):
+    x, y, size, region, params_id = blob
+    return {"x": x, "y": y, "size": size, "region": region, "params_id": params_id}
+
+
+def write_jsonl(records, output_path, include_blobs):
+    """One JSON object per image with its label names and blobs."""
+    counts = {"images": 0, "labels": 0, "blobs": 0}
+    with open(output_path, "w") as f:
+        for image_id, image_path, labels, blobs in records:
+            record = {
+                "image_id": image_id,
+                "image_path": image_path,
+                "labels": [label_name for _, label_name in labels],
+            }
+            if include_blobs:
+                record["blobs"] = [_blob_dict(blob) for blob in blobs]
+            f.write(json.dumps(record))
+            f.write("\n")
+            counts["images"] += 1
+            counts["labels"] += len(labels)
+            counts["blobs"] += len(blobs)
+            yield counts
+
+
+def write_coco(conn, label_filter, include_blobs, output_path, chunk_size=CHUNK_SIZE):
+    """COCO-style JSON written as it is read: images, then annotations.
+
+    Image labels become annotations without a bbox, blobs become one-keypoint
+    annotations with a bbox, categorised by face region. Image sizes are not
+    stored in labels.db, so width and height are left out.
+    """
+    counts = {"images": 0, "labels": 0, "blobs": 0}
+    categories = [
+        {"id": label_id, "name": label_name, "supercategory": "label"}
+        for label_id, label_name in conn.execute(
+            "SELECT id, label_name FROM labels ORDER BY id"
+        )
+    ]
+    region_ids = {}
+    if include_blobs:
+        next_id = max((c["id"] for c in categories), default=0) + 1
+        for (region,) in conn.execute("SELECT DISTINCT label FROM blobs ORDER BY 1"):
+            region_ids[region] = next_id
+            categories.append(
+                {
+                    "id": next_id,
+                    "name": f"blob/{region}",
+                    "supercategory": "blob",
+                    "keypoints": ["center"],
+                }
+            )
+            next_id += 1
+
+    with open(output_path, "w") as f:
+        f.write('{"info": ')
+        json.dump({"description": "labeling_tool export", "version": "1.0"}, f)
+        f.write(', "categories": ')
+        json.dump(categories, f)
+        f.write(', "images": [')
+        for image_id, image_path in iter_images(conn, label_filter, chunk_size):
+            if counts["images"]:
+                f.write(", ")
+            # json.dumps of a small object is much faster than json.dump to a file
+            f.write(
+                json.dumps(
+                    {
+                        "id": image_id,
+                        "file_name": os.path.basename(image_path),
+                        "path": image_path,
+                    }
+                )
+            )
+            counts["images"] += 1
+        f.write('], "annotations": [')
+        # the images are read a second time with their labels and blobs,
+        # progress follows this pass
+        annotation_id = 0
+        for image_id, _, labels, blobs in iter_image_records(
+            conn, label_filter, include_blobs, chunk_size
+        ):
+            annotations = [
+                {"image_id": image_id, "category_id": label_id}
+                for label_id, _ in labels
+            ]
+            for x, y, size, region, params_id in blobs:
+                radius = size / 2
+                annotations.append(
+                    {
+                        "image_id": image_id,
+                        "category_id": region_ids[region],
+                        "bbox": [x - radius, y - radius, size, size],
+                        "area": math.pi * radius * radius,
+                        "iscrowd": 0,
+                        "keypoints": [x, y, 2],
+                        "num_keypoints": 1,
+                        "params_id": params_id,
+                    }
+                )
+            for annotation in annotations:
+                if annotation_id:
+                    f.write(", ")
+                annotation_id += 1
+                f.write(json.dumps({"id": annotation_id, **annotation}))
+            counts["labels"] += len(labels)
+            counts["blobs"] += len(blobs)
+            yield counts
+        f.write("]}")
+
+
+def export_labels(
+    db_path,
+    output_path,
+    export_format=None,
+    label_names=None,
+    include_blobs=None,
+    chunk_size=CHUNK_SIZE,
+    progress=None,
+):
+    """Stream the labels of a workspace database to a CSV, JSONL or COCO file.
+
+    label_names restricts the export to images carrying one of those labels,
+    and to those labels. include_blobs=None exports the blobs if labels.db
+    has a blobs table; the CSV format writes them to <output>_blobs.csv.
+    progress(images written) is called every chunk_size images. Returns a
+    dict with the image, label and blob counts and the elapsed seconds.
+    """
+    export_format = export_format or export_format_for(output_path)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {export_format!r}")
+    start = time.perf_counter()
+    conn = open_readonly(db_path)
+    try:
+        blobs_available = has_blobs_table(conn)
+        if include_blobs is None:
+            include_blobs = blobs_available
+        elif include_blobs and not blobs_available:
+            raise ValueError("the database has no blobs table")
+        label_filter = _Filter(label_ids_for(conn, label_names or []))
+
+        if export_format == "coco":
+            written = write_coco(
+                conn, label_filter, include_blobs, output_path, chunk_size
+            )
+        else:
+            records = iter_image_records(conn, label_filter, include_blobs, chunk_size)
+            if export_format == "csv":
+                blobs_path = None
+                if include_blobs:
+                    blobs_path = os.path.splitext(output_path)[0] + "_blobs.csv"
+                written = write_csv(records, output_path, blobs_path)
+            else:
+                written = write_jsonl(records, output_path, include_blobs)
+
+        counts = {"images": 0, "labels": 0, "blobs": 0}
+        for done, counts in enumerate(written, 1):
+            if progress is not None and done % chunk_size == 0:
+                progress(done)
+        counts = dict(counts)
+    finally:
+        conn.close()
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the labels (and blobs) of a workspace database."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing labels.db"
+    )
+    parser.add_argument("output", help="file to write (.csv, .jsonl or .json)")
+    parser.add_argument(
+        "--format",
+        choices=EXPORT_FORMATS,
+        help="export format (default: from the output extension, .json is coco)",
+    )
+    parser.add_argument(
+        "--label",
+        action="append",
+        dest="labels",
+        metavar="NAME",
+        help="only export images with this label, can be repeated",
+    )
+    blobs = parser.add_mutually_exclusive_group()
+    blobs.add_argument(
+        "--blobs",
+        action="store_true",
+        default=None,
+        help="include the blob keypoints (default: when labels.db has them)",
+    )
+    blobs.add_argument(
+        "--no-blobs", action="store_false", dest="blobs", help="leave the blobs out"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE, help="rows fetched at a time"
+    )
+    args = parser.parse_args()
+    if not (args.format or export_format_for(args.output)):
+        parser.error("cannot tell the format from the output extension, use --format")
+    try:
+        counts = export_labels(
+            os.path.join(args.workspace, "labels.db"),
+            args.output,
+            args.format,
+            args.labels,
+            args.blobs,
+            args.chunk_size,
+        )
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+    print(
+        f"Exported {counts['images']} images, {counts['labels']} labels and "
+        f"{counts['blobs']} blobs to {args.output} in {counts['seconds']:.2f}s"
+    )
@@ -2,12 +2,24 @@ import dataclasses
 import os
 import glob
 
-import matplotlib.pyplot as plt
 import numpy as np
-import torch
 from PIL import Image
-from torch import nn
-from transformers import SegformerForSemanticSegmentation, SegformerImageProcessor
+
+from modules.mask_io import save_mask
+from modules.segmentation_backends import MODEL_NAME, create_backend
+from modules.segmentation_cache import SegmentationCache
+from modules.tracing import enabled, span
+
+# torch, transformers and matplotlib take seconds to import, so they are only
+# imported inside the methods that need them
+
+# how the low resolution logits are brought back to the image size:
+# "full" upsamples all class logits at once (exact, memory grows with W*H*C),
+# "tiled" gives the same labels but upsamples a band of rows at a time,
+# "nearest" takes the argmax first and upsamples the labels (least memory,
+# blockier class boundaries)
+UPSAMPLE_MODES = ("full", "tiled", "nearest")
+DEFAULT_TILE_ROWS = 256
 
 
 @dataclasses.dataclass
@@ -18,47 +30,239 @@ class Face_Image:
 
 
 class FaceSegmentation:
-    def __init__(self):
+    def __init__(
+        self,
+        upsample_mode="full",
+        tile_rows=DEFAULT_TILE_ROWS,
+        backend=None,
+        onnx_path=None,
+        cache=None,
+        device=None,
+    ):
+        from transformers import SegformerImageProcessor
 
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.image_processor = SegformerImageProcessor.from_pretrained(MODEL_NAME)
+        # "torch" or "onnx", see segmentation_backends.create_backend
+        self.backend = create_backend(backend, onnx_path, device)
+        self.device = self.backend.device
 
-        self.image_processor = SegformerImageProcessor.from_pretrained(
-            "jonathandinu/face-parsing"
-        )
-        self.model = SegformerForSemanticSegmentation.from_pretrained(
-            "jonathandinu/face-parsing"
-        )
-        self.model.to(self.device)
+        if upsample_mode not in UPSAMPLE_MODES:
+            raise ValueError(f"unknown upsample mode {upsample_mode!r}")
+        self.upsample_mode = upsample_mode
+        self.tile_rows = tile_rows
+        # largest tensor footprint of any upsample so far, see upsample_labels
+        self.peak_upsample_bytes = 0
 
-    def segment_face(self, image_input_path, output_path, output_mask_path):
-        print(f"Segmenting face in {image_input_path}")
+        # results are reused for identical image bytes and model, across
+        # workspaces; cache=False always runs the model
+        if cache is None:
+            cache = SegmentationCache()
+        self.cache = None if cache is False else cache
+        # images are decoded without their EXIF orientation (see frame.py);
+        # results cached before that was consistent are keyed without it
+        self.model_key = f"{self.backend.model_id}/{upsample_mode}/file-orientation"
 
-        image = Image.open(image_input_path)
-        inputs = self.image_processor(images=image, return_tensors="pt").to(self.device)
-        outputs = self.model(**inputs)
-        logits = outputs.logits
+    def reuse_cached(self, image_input_path, output_path, output_mask_path):
+        """Place a cached result at the output paths; returns False on a miss."""
+        if self.cache is None:
+            return False
+        key = self.cache.key(image_input_path, self.model_key)
+        return self.cache.fetch(key, output_path, output_mask_path)
 
-        # resize output to match input image dimensions
+    def store_cached(self, image_input_path, output_path, output_mask_path):
+        if self.cache is not None:
+            key = self.cache.key(image_input_path, self.model_key)
+            self.cache.store(key, output_path, output_mask_path)
 
-        upsampled_logits = nn.functional.interpolate(
-            logits,
-            size=image.size[::-1],
-            mode="bilinear",
-            align_corners=False,  # H x W
-        )
-        labels = upsampled_logits.argmax(dim=1)[0]
+    def segment_face(self, image_input_path, output_path, output_mask_path, frame=None):
+        """Segment one image; frame is the image already decoded as a Frame."""
+        import torch
+
+        with span("segment.total", image=image_input_path):
+            with span("segment.cache_fetch"):
+                reused = self.reuse_cached(
+                    image_input_path, output_path, output_mask_path
+                )
+            if reused:
+                print(f"Reused cached segmentation of {image_input_path}")
+                return
+
+            print(f"Segmenting face in {image_input_path}")
+
+            if frame is not None:
+                # the processor takes the RGB array view, no second decode;
+                # the caller timed the decode of the frame
+                image, image_size = frame.rgb(), frame.size
+            else:
+                with span("segment.decode"):
+                    image = Image.open(image_input_path)
+                    # PIL decodes lazily, load now so decoding is not timed as
+                    # preprocessing
+                    image.load()
+                    image_size = image.size
+            with torch.inference_mode():
+                with span("segment.preprocess"):
+                    inputs = self.image_processor(images=image, return_tensors="pt")
+                logits = self.forward(inputs["pixel_values"])
+                with span("segment.upsample"):
+                    labels_viz = self.upsample_labels(logits[0], image_size)
+
+            self.save_outputs(labels_viz, output_path, output_mask_path)
+            with span("segment.cache_store"):
+                self.store_cached(image_input_path, output_path, output_mask_path)
+
+    def segment_images(
+        self, images, output_paths, output_mask_paths, image_input_paths=None
+    ):
+        """Segment already decoded PIL images with a single forward pass.
+
+        The results are added to the cache when image_input_paths is given.
+        """
+        import torch
+
+        with torch.inference_mode():
+            with span("segment.preprocess", images=len(images)):
+                inputs = self.image_processor(images=images, return_tensors="pt")
+            logits = self.forward(inputs["pixel_values"], images=len(images))
+
+            for image, image_logits, output_path, output_mask_path in zip(
+                images, logits, output_paths, output_mask_paths
+            ):
+                with span("segment.upsample"):
+                    labels_viz = self.upsample_labels(image_logits, image.size)
+                self.save_outputs(labels_viz, output_path, output_mask_path)
+
+        if image_input_paths is not None:
+            for paths in zip(image_input_paths, output_paths, output_mask_paths):
+                self.store_cached(*paths)
+
+    def forward(self, pixel_values, **span_args):
+        """Run the model on preprocessed pixel values, timed as segment.forward."""
+        import torch
+
+        with span("segment.forward", **span_args):
+            logits = self.backend.logits(pixel_values)
+            if self.device == "cuda" and enabled():
+                # CUDA kernels run asynchronously; without waiting for them
+                # their time would be counted in segment.upsample
+                torch.cuda.synchronize()
+        return logits
+
+    def upsample_labels(self, logits, image_size):
+        """Resize [C, h, w] logits to the image size (W, H) and take the argmax."""
+        if self.upsample_mode == "tiled":
+            labels, peak_bytes = upsample_labels_tiled(
+                logits, image_size, self.tile_rows
+            )
+        elif self.upsample_mode == "nearest":
+            labels, peak_bytes = upsample_labels_nearest(logits, image_size)
+        else:
+            labels, peak_bytes = upsample_labels_full(logits, image_size)
+        self.peak_upsample_bytes = max(self.peak_upsample_bytes, peak_bytes)
+        return labels.cpu().numpy()
+
+    def save_outputs(self, labels_viz, output_path, output_mask_path):
+        # matplotlib.image does the same as plt.imsave without loading pyplot
+        # and a GUI backend, which matters when called off the main thread
+        from matplotlib import image as mpimg
 
-        labels_viz = labels.cpu().numpy()
+        # outputs may be hard links into the segmentation cache, so they are
+        # replaced rather than overwritten in place
+        for path in (output_path, output_mask_path):
+            if path and os.path.exists(path):
+                os.remove(path)
 
         if output_path:
             ##save the segmented image with the same name + _segmented in the output directory
 
-            plt.imsave(output_path, labels_viz)
+            with span("segment.save_image"):
+                mpimg.imsave(output_path, labels_viz)
 
         if output_mask_path:
-            ##save the mask npy file with the same name + _mask in the output directory
+            ##save the uint8 mask with the same name + _mask in the output directory
+
+            with span("segment.save_mask"):
+                save_mask(output_mask_path, labels_viz)
+
+
+def _tensor_bytes(*tensors):
+    return sum(t.element_size() * t.nelement() for t in tensors)
+
+
+def upsample_labels_full(logits, image_size):
+    """Bilinear upsample of every class logit, then argmax.
+
+    Returns (labels [H, W], bytes of the tensors alive at the peak).
+    """
+    from torch import nn
+
+    upsampled_logits = nn.functional.interpolate(
+        logits.unsqueeze(0),
+        size=image_size[::-1],
+        mode="bilinear",
+        align_corners=False,  # H x W
+    )
+    labels = upsampled_logits.argmax(dim=1)[0]
+    return labels, _tensor_bytes(logits, upsampled_logits, labels)
+
+
+def _bilinear_weights(in_size, out_size, dtype, device):
+    """[out_size, in_size] matrix of 1-D bilinear weights, align_corners=False."""
+    import torch
+
+    scale = in_size / out_size
+    src = ((torch.arange(out_size, device=device) + 0.5) * scale - 0.5).clamp(min=0)
+    i0 = src.floor().long().clamp(max=in_size - 1)
+    i1 = (i0 + 1).clamp(max=in_size - 1)
+    w1 = (src - i0).to(dtype)
+    weights = torch.zeros(out_size, in_size, dtype=dtype, device=device)
+    rows = torch.arange(out_size, device=device)
+    weights.index_put_((rows, i0), 1 - w1, accumulate=True)
+    weights.index_put_((rows, i1), w1, accumulate=True)
+    return weights
+
+
+def upsample_labels_tiled(logits, image_size, tile_rows=DEFAULT_TILE_ROWS):
+    """Same labels as upsample_labels_full, one band of output rows at a time.
+
+    Bilinear resizing is separable: the columns are interpolated once to a
+    [C, h, W] tensor, then each band of tile_rows output rows is interpolated
+    and reduced to labels before the next one is computed, so memory grows
+    with C*tile_rows*W instead of C*H*W.
+    """
+    import torch
+
+    width, height = image_size
+    num_classes, in_height, in_width = logits.shape
+    col_weights = _bilinear_weights(in_width, width, logits.dtype, logits.device)
+    row_weights = _bilinear_weights(in_height, height, logits.dtype, logits.device)
+    # [C, h, w] @ [w, W] -> [C, h, W]
+    columns = logits @ col_weights.T
+
+    # 19 classes fit in uint8, a long label map would be 8 bytes per pixel
+    labels = torch.empty(height, width, dtype=torch.uint8, device=logits.device)
+    peak_bytes = 0
+    for top in range(0, height, tile_rows):
+        # [t, h] @ [C, h, W] -> [C, t, W]
+        band = torch.matmul(row_weights[top : top + tile_rows], columns)
+        labels[top : top + tile_rows] = band.argmax(dim=0)
+        peak_bytes = max(
+            peak_bytes,
+            _tensor_bytes(logits, col_weights, row_weights, columns, labels, band),
+        )
+    return labels, peak_bytes
+
+
+def upsample_labels_nearest(logits, image_size):
+    """Argmax at the logits resolution, then nearest-neighbour upsample the labels."""
+    import torch
+    from torch import nn
 
-            np.save(output_mask_path, labels_viz)
+    small_labels = logits.argmax(dim=0).to(dtype=logits.dtype)
+    labels = nn.functional.interpolate(
+        small_labels[None, None], size=image_size[::-1], mode="nearest"
+    )[0, 0].to(torch.uint8)
+    return labels, _tensor_bytes(logits, small_labels, labels)
 
 
 if __name__ == "__main__":
@@ -70,7 +274,7 @@ if __name__ == "__main__":
     input_image = input_images[0]
     output_image_name = os.path.basename(input_image).split(".")[0] + "_segmented.png"
     output_image_path = os.path.join(face_output_dir, output_image_name)
-    output_mask_output_name = os.path.basename(input_image).split(".")[0] + "_mask.npy"
+    output_mask_output_name = os.path.basename(input_image).split(".")[0] + "_mask.png"
     output_mask_path = os.path.join(face_mask_dir, output_mask_output_name)
 
     print(f"Segmenting face in {input_image}")
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+
+# Qt is imported in the display methods only, blob worker processes never
+# need it
+
+# the EXIF orientation is not applied, like PIL.Image.open and QImageReader
+# do by default, so the segmentation masks, the blobs and the displayed image
+# all share the pixel layout of the file whichever decoder made them
+IMREAD_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+
+class Frame:
+    """An image decoded once, shared by segmentation, blob detection and display.
+
+    The pixels are kept as the BGR uint8 array cv2 decodes to. rgb() and
+    qimage() share that buffer instead of decoding the file again, so treat
+    the array as read-only and copy it before drawing on it; pil() copies.
+    """
+
+    def __init__(self, bgr, path=None):
+        self.bgr = np.ascontiguousarray(bgr)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        bgr = cv2.imread(path, IMREAD_FLAGS)
+        if bgr is None:
+            raise IOError(f"could not read image {path}")
+        return cls(bgr, path)
+
+    @property
+    def size(self):
+        """(width, height), like PIL.Image.size."""
+        return self.bgr.shape[1], self.bgr.shape[0]
+
+    def rgb(self):
+        """RGB view of the pixels, accepted by the Segformer image processor."""
+        return self.bgr[..., ::-1]
+
+    def pil(self):
+        """PIL copy of the image, for code that only takes PIL images."""
+        from PIL import Image
+
+        return Image.fromarray(np.ascontiguousarray(self.rgb()))
+
+    def qimage(self):
+        """QImage over the same buffer; only valid while the frame is alive."""
+        from PySide6.QtGui import QImage
+
+        height, width = self.bgr.shape[:2]
+        return QImage(
+            self.bgr.data,
+            width,
+            height,
+            self.bgr.strides[0],
+            QImage.Format.Format_BGR888,
+        )
+
+    def display_image(self, max_size=None):
+        """QImage that owns its pixels, scaled down to fit max_size if given.
+
+        Used to put the frame in the display cache, which outlives the frame.
+        """
+        from PySide6.QtCore import Qt
+
+        image = self.qimage()
+        if max_size is not None and (
+            image.width() > max_size.width() or image.height() > max_size.height()
+        ):
+            # scaling writes a new image, so no extra copy is needed
+            return image.scaled(
+                max_size,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+        return image.copy()
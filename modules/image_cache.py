@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QImageReader
+
+
+def load_image(image_path, max_size=None):
+    """Decode an image, scaled down to fit max_size (a QSize) if given.
+
+    Returns a null QImage if the file does not exist or cannot be read.
+    QImage (unlike QPixmap) can be created outside the GUI thread.
+    """
+    if not os.path.exists(image_path):
+        return QImage()
+    reader = QImageReader(image_path)
+    if max_size is not None:
+        size = reader.size()
+        if size.isValid() and (
+            size.width() > max_size.width() or size.height() > max_size.height()
+        ):
+            # lets the jpeg decoder skip most of the work for large photos
+            reader.setScaledSize(
+                size.scaled(max_size, Qt.AspectRatioMode.KeepAspectRatio)
+            )
+    return reader.read()
+
+
+class ImageCache:
+    """Memory-bounded LRU cache of decoded images with background prefetch.
+
+    Images are decoded at most at max_size, so a cached frame is enough to
+    fill the window at any size up to the screen without touching the disk.
+    loader(image_path, max_size) does the decoding, load_image by default.
+    """
+
+    def __init__(
+        self, max_bytes=512 * 1024 * 1024, max_size=None, workers=2, loader=load_image
+    ):
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        self.loader = loader
+        self._images = OrderedDict()  # path -> QImage, least recently used first
+        self._bytes = 0
+        self._pending = {}  # path -> Future of a queued or running decode
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="image-prefetch"
+        )
+
+    def get(self, image_path):
+        """Return the cached image, or None without touching the disk."""
+        with self._lock:
+            image = self._images.get(image_path)
+            if image is not None:
+                self._images.move_to_end(image_path)
+            return image
+
+    def load(self, image_path):
+        """Return the decoded image, decoding it now if it is not cached."""
+        image = self.get(image_path)
+        if image is not None:
+            return image
+        with self._lock:
+            future = self._pending.get(image_path)
+        if future is not None:
+            # a prefetch worker is already decoding it, wait for that result
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+        return self._decode(image_path)
+
+    def prefetch(self, image_paths):
+        """Decode the given paths in the background, in order.
+
+        Queued decodes of paths that are no longer wanted are dropped, so
+        fast navigation does not pile up stale work.
+        """
+        wanted = set(image_paths)
+        with self._lock:
+            for image_path, future in list(self._pending.items()):
+                if image_path not in wanted and future.cancel():
+                    del self._pending[image_path]
+            for image_path in image_paths:
+                if image_path in self._images or image_path in self._pending:
+                    continue
+                self._pending[image_path] = self._executor.submit(
+                    self._decode, image_path
+                )
+
+    def put(self, image_path, image):
+        """Cache an image decoded or rendered elsewhere, e.g. from a Frame."""
+        with self._lock:
+            self._insert(image_path, image)
+
+    def invalidate(self, image_path):
+        with self._lock:
+            image = self._images.pop(image_path, None)
+            if image is not None:
+                self._bytes -= image.sizeInBytes()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def _decode(self, image_path):
+        image = self.loader(image_path, self.max_size)
+        with self._lock:
+            self._pending.pop(image_path, None)
+            # missing files are not cached, they may be generated later
+            if not image.isNull():
+                self._insert(image_path, image)
+        return image
+
+    def _insert(self, image_path, image):
+        previous = self._images.pop(image_path, None)
+        if previous is not None:
+            self._bytes -= previous.sizeInBytes()
+        self._images[image_path] = image
+        self._bytes += image.sizeInBytes()
+        # evict least recently used images, always keeping the newest one
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= evicted.sizeInBytes()
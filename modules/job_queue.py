@@ -0,0 +1,133 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+
+# QThreadPool runs queued jobs with a higher priority first
+LOW_PRIORITY = 0
+HIGH_PRIORITY = 10
+
+
+class _JobSignals(QObject):
+    done = Signal(object, object)  # job, result
+    error = Signal(object, str)  # job, message
+
+
+class Job(QRunnable):
+    def __init__(self, kind, image_path, func, signals):
+        super().__init__()
+        # the queue keeps the reference, so Qt must not delete it after run()
+        self.setAutoDelete(False)
+        self.kind = kind
+        self.image_path = image_path
+        self.func = func
+        self.signals = signals
+        self.cancelled = False
+        # see JobQueue.cancel_all(drop_running=True)
+        self.generation = 0
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            result = self.func()
+        except Exception as e:
+            self.signals.error.emit(self, str(e))
+            return
+        self.signals.done.emit(self, result)
+
+
+class JobQueue(QObject):
+    """Runs segmentation and blob jobs off the GUI thread.
+
+    Segmentation jobs share one model and run one at a time, blob jobs run
+    on a pool sized to the machine. A job is identified by (kind, image
+    path), so requesting the same job twice while it is queued is a no-op.
+    Completion is reported through signals delivered on the GUI thread.
+    """
+
+    finished = Signal(str, str, object)  # kind, image path, result
+    failed = Signal(str, str, str)  # kind, image path, message
+    pending_changed = Signal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pools = {"segment": QThreadPool(self), "blob": QThreadPool(self)}
+        self.pools["segment"].setMaxThreadCount(1)
+        self.jobs = {}  # (kind, image path) -> queued or running Job
+        self.priorities = {}  # (kind, image path) -> priority it was queued with
+        # bumped to disown the running jobs, whose results are then dropped
+        self.generation = 0
+        self._signals = _JobSignals()
+        self._signals.done.connect(self._on_done)
+        self._signals.error.connect(self._on_error)
+
+    def submit(self, kind, image_path, func, priority=LOW_PRIORITY):
+        """Queue func() as a job; returns False if the job is already queued."""
+        key = (kind, image_path)
+        if key in self.jobs:
+            if priority > self.priorities[key]:
+                self._requeue(key, priority)
+            return False
+        job = Job(kind, image_path, func, self._signals)
+        job.generation = self.generation
+        self.jobs[key] = job
+        self.priorities[key] = priority
+        self.pools[kind].start(job, priority)
+        self.pending_changed.emit(len(self.jobs))
+        return True
+
+    def is_pending(self, kind, image_path):
+        return (kind, image_path) in self.jobs
+
+    def prioritise(self, image_path):
+        """Move the queued jobs of an image ahead of everything else."""
+        for kind in self.pools:
+            key = (kind, image_path)
+            if key in self.jobs:
+                self._requeue(key, HIGH_PRIORITY)
+
+    def cancel(self, kind, image_path):
+        """Drop a queued job; a job that is already running is left to finish."""
+        key = (kind, image_path)
+        job = self.jobs.get(key)
+        if job is not None and self.pools[kind].tryTake(job):
+            job.cancelled = True
+            self._forget(key)
+
+    def cancel_all(self, drop_running=False):
+        """Drop the queued jobs.
+
+        With drop_running, the jobs already running are left to finish but
+        their results are never reported, e.g. when the workspace changes.
+        """
+        for kind, image_path in list(self.jobs):
+            self.cancel(kind, image_path)
+        if drop_running:
+            self.generation += 1
+            for key in list(self.jobs):
+                self._forget(key)
+
+    def wait(self):
+        for pool in self.pools.values():
+            pool.waitForDone()
+
+    def _requeue(self, key, priority):
+        job = self.jobs[key]
+        # a running job cannot be taken back, it is already at the front
+        if self.pools[key[0]].tryTake(job):
+            self.priorities[key] = priority
+            self.pools[key[0]].start(job, priority)
+
+    def _forget(self, key):
+        self.jobs.pop(key, None)
+        self.priorities.pop(key, None)
+        self.pending_changed.emit(len(self.jobs))
+
+    def _on_done(self, job, result):
+        if job.generation == self.generation:
+            self._forget((job.kind, job.image_path))
+            self.finished.emit(job.kind, job.image_path, result)
+
+    def _on_error(self, job, message):
+        if job.generation == self.generation:
+            self._forget((job.kind, job.image_path))
+            self.failed.emit(job.kind, job.image_path, message)
@@ -0,0 +1,59 @@
+class LabelIndex:
+    """In-memory copy of the lookup tables used on every labeling keystroke.
+
+    Loaded once from a LabelDatabase and kept in step with every write the
+    app makes, so a key press only costs the single INSERT or DELETE.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.image_ids = {}  # image path -> image id
+        self.label_keys = {}  # upper-cased key binding -> label id
+        self.label_names = {}  # label id -> label name
+        self.image_labels = {}  # image id -> set of label ids
+
+    def load_labels(self, db):
+        self.label_keys = {}
+        self.label_names = {}
+        for label_id, label_name, key_binding in db.labels():
+            self.label_keys[key_binding.upper()] = label_id
+            self.label_names[label_id] = label_name
+
+    def load_images(self, db):
+        self.image_ids = dict(db.image_ids())
+        self.image_labels = {}
+        for image_id, label_id in db.image_label_pairs():
+            self.image_labels.setdefault(image_id, set()).add(label_id)
+
+    def remove_label(self, label_id):
+        self.label_names.pop(label_id, None)
+        self.label_keys = {
+            key: key_label_id
+            for key, key_label_id in self.label_keys.items()
+            if key_label_id != label_id
+        }
+        for label_ids in self.image_labels.values():
+            label_ids.discard(label_id)
+
+    def has_label(self, image_id, label_id):
+        return label_id in self.image_labels.get(image_id, ())
+
+    def set_label(self, image_id, label_id, enabled):
+        if enabled:
+            self.image_labels.setdefault(image_id, set()).add(label_id)
+        else:
+            self.image_labels.get(image_id, set()).discard(label_id)
+
+    def set_label_for_images(self, image_ids, label_id, enabled):
+        for image_id in image_ids:
+            self.set_label(image_id, label_id, enabled)
+
+    def labels_for_image(self, image_id):
+        """Return the names of the labels set on an image, in label id order."""
+        return [
+            self.label_names[label_id]
+            for label_id in sorted(self.image_labels.get(image_id, ()))
+            if label_id in self.label_names
+        ]
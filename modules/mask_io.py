@@ -0,0 +1,91 @@
+import argparse
+import glob
+import os
+
+import cv2
+import numpy as np
+
+
+# FACE_PARSING_LABELS has 19 classes, so every mask fits in a uint8
+MASK_DTYPE = np.uint8
+
+
+def save_mask(mask_path, labels):
+    """Save a label mask as uint8, in the format given by the file extension.
+
+    .png is a lossless zlib-compressed 8-bit image (the default for new
+    masks); .npy is an uncompressed uint8 array that np.load can memory-map.
+    """
+    mask = np.asarray(labels)
+    if mask.size and mask.max() > np.iinfo(MASK_DTYPE).max:
+        raise ValueError(f"mask values do not fit in {MASK_DTYPE.__name__}")
+    mask = mask.astype(MASK_DTYPE, copy=False)
+    if mask_path.endswith(".png"):
+        if not cv2.imwrite(mask_path, mask, [cv2.IMWRITE_PNG_COMPRESSION, 3]):
+            raise IOError(f"could not write mask {mask_path}")
+    else:
+        np.save(mask_path, mask)
+
+
+def load_mask(mask_path, mmap_mode=None):
+    """Load a mask saved by save_mask, or a legacy int64 .npy mask, as uint8.
+
+    mmap_mode is passed to np.load for .npy masks; a memory-mapped legacy
+    int64 mask is returned as is, since casting would read all of it.
+    """
+    if mask_path.endswith(".png"):
+        mask = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
+        if mask is None:
+            raise IOError(f"could not read mask {mask_path}")
+        return mask
+    mask = np.load(mask_path, mmap_mode=mmap_mode)
+    if mmap_mode is None:
+        mask = mask.astype(MASK_DTYPE, copy=False)
+    return mask
+
+
+def migrate_masks(mask_folder, remove_legacy=True):
+    """Convert the legacy int64 *_mask.npy files of a folder to uint8 PNG.
+
+    Each converted mask is read back and compared before the .npy file is
+    removed. Returns (converted count, bytes before, bytes after).
+    """
+    converted = 0
+    bytes_before = 0
+    bytes_after = 0
+    for legacy_path in glob.glob(os.path.join(mask_folder, "*_mask.npy")):
+        mask_path = legacy_path[: -len(".npy")] + ".png"
+        labels = np.load(legacy_path)
+        save_mask(mask_path, labels)
+        if not np.array_equal(load_mask(mask_path), labels):
+            os.remove(mask_path)
+            raise ValueError(f"mask {legacy_path} did not survive conversion")
+        bytes_before += os.path.getsize(legacy_path)
+        bytes_after += os.path.getsize(mask_path)
+        if remove_legacy:
+            os.remove(legacy_path)
+        converted += 1
+    return converted, bytes_before, bytes_after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a workspace's int64 .npy masks to compact uint8 PNG."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing the raw images"
+    )
+    parser.add_argument(
+        "--keep-legacy",
+        action="store_true",
+        help="keep the .npy files after converting them",
+    )
+    args = parser.parse_args()
+    mask_folder = os.path.join(args.workspace, "segmented_images", "masks")
+    converted, bytes_before, bytes_after = migrate_masks(
+        mask_folder, remove_legacy=not args.keep_legacy
+    )
+    print(
+        f"Converted {converted} masks: {bytes_before / 1e6:.1f} MB -> "
+        f"{bytes_after / 1e6:.1f} MB"
+    )
@@ -0,0 +1,256 @@
+import argparse
+import os
+
+import numpy as np
+
+from modules.mask_io import MASK_DTYPE, load_mask
+from modules.workspace import existing_mask_path
+
+
+def _index_dtype(path_width):
+    """One row per stored mask, sorted by image id when written.
+
+    The mask file a mask was imported from is recorded with its mtime and
+    size; mask_path is as wide as the longest path in the store.
+    """
+    return np.dtype(
+        [
+            ("image_id", np.int64),
+            ("offset", np.int64),
+            ("height", np.int32),
+            ("width", np.int32),
+            ("mask_path", f"U{max(path_width, 1)}"),
+            ("mask_mtime_ns", np.int64),
+            ("mask_size", np.int64),
+        ]
+    )
+
+
+def _file_stamp(path):
+    """(mtime in ns, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class MaskStore:
+    """Workspace-level store of uint8 masks in a single memory-mapped file.
+
+    Masks are appended to masks.bin; index.npy maps each image id (the id in
+    labels.db) to the offset and shape of its mask, and to the mask file it
+    was imported from. get() returns a view on the memory map, so sampling a
+    few pixels or a small region only pages in the parts of the file that
+    are touched.
+
+    Image ids change when labels.db is rebuilt and mask files are rewritten
+    when an image is segmented again, so check is_current() before trusting
+    a stored mask.
+    """
+
+    def __init__(self, store_folder, writable=False):
+        self.store_folder = store_folder
+        self.data_path = os.path.join(store_folder, "masks.bin")
+        self.index_path = os.path.join(store_folder, "index.npy")
+        self.writable = writable
+        # image id -> (offset, height, width, mask path, mtime ns, size)
+        self.entries = {}
+        self._data = None
+        self._dirty = False
+        if writable:
+            os.makedirs(store_folder, exist_ok=True)
+        if os.path.exists(self.index_path):
+            index = np.load(self.index_path)
+            if "mask_path" in index.dtype.names:
+                for row in index.tolist():
+                    self.entries[row[0]] = row[1:]
+            else:
+                # stores written before the source was recorded are never
+                # current, their masks are re-imported or read from the files
+                for image_id, offset, height, width in index.tolist():
+                    self.entries[image_id] = (offset, height, width, "", 0, 0)
+
+    @staticmethod
+    def default_folder(workspace_path):
+        return os.path.join(workspace_path, "mask_store")
+
+    @classmethod
+    def exists(cls, store_folder):
+        return os.path.exists(os.path.join(store_folder, "index.npy"))
+
+    def __contains__(self, image_id):
+        return image_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, image_id):
+        """Return the mask of an image as a read-only memory-mapped array."""
+        offset, height, width = self.entries[image_id][:3]
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=MASK_DTYPE, mode="r")
+        return self._data[offset : offset + height * width].reshape(height, width)
+
+    def is_current(self, image_id, mask_path, shape=None):
+        """True if the stored mask of an image is the one in mask_path.
+
+        The entry must have been imported from mask_path, the file must not
+        have changed since, and the mask must have the given (height, width).
+        """
+        entry = self.entries.get(image_id)
+        if entry is None:
+            return False
+        _, height, width, stored_path, mtime_ns, size = entry
+        if shape is not None and tuple(shape) != (height, width):
+            return False
+        return stored_path == mask_path and _file_stamp(mask_path) == (mtime_ns, size)
+
+    def labels_at(self, image_id, xs, ys):
+        """Return the class of the mask at each (x, y) point."""
+        mask = self.get(image_id)
+        return mask[np.asarray(ys, dtype=np.intp), np.asarray(xs, dtype=np.intp)]
+
+    def region_counts(self, image_id, x0, y0, x1, y1, num_classes=256):
+        """Return the pixel count of every class inside a rectangle."""
+        region = self.get(image_id)[y0:y1, x0:x1]
+        return np.bincount(region.ravel(), minlength=num_classes)
+
+    def put(self, image_id, mask, mask_path=""):
+        """Append a mask; a replaced mask leaves its old bytes until compact().
+
+        mask_path is the file the mask was read from, see is_current.
+        """
+        if not self.writable:
+            raise IOError("mask store is opened read-only")
+        mask = np.ascontiguousarray(mask, dtype=MASK_DTYPE)
+        mtime_ns, size = _file_stamp(mask_path) or (0, 0)
+        with open(self.data_path, "ab") as f:
+            offset = f.tell()
+            f.write(mask.tobytes())
+        self.entries[image_id] = (
+            offset,
+            mask.shape[0],
+            mask.shape[1],
+            mask_path,
+            mtime_ns,
+            size,
+        )
+        # the memory map has to be reopened to see the appended bytes
+        self._data = None
+        self._dirty = True
+
+    def discard(self, image_ids):
+        """Forget the stored masks of some images, e.g. after re-segmenting them."""
+        if not self.writable:
+            raise IOError("mask store is opened read-only")
+        for image_id in image_ids:
+            if self.entries.pop(image_id, None) is not None:
+                self._dirty = True
+
+    def flush(self):
+        """Write the index; masks added since the last flush are not visible before."""
+        if not self._dirty:
+            return
+        path_width = max((len(entry[3]) for entry in self.entries.values()), default=0)
+        index = np.array(
+            [(image_id, *entry) for image_id, entry in sorted(self.entries.items())],
+            dtype=_index_dtype(path_width),
+        )
+        tmp_path = self.index_path + ".tmp.npy"
+        np.save(tmp_path, index)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def close(self):
+        if self.writable:
+            self.flush()
+        self._data = None
+
+    def unreferenced_bytes(self):
+        """Bytes of masks.bin left behind by replaced or discarded masks."""
+        if not os.path.exists(self.data_path):
+            return 0
+        live = sum(height * width for _, height, width, *_ in self.entries.values())
+        return os.path.getsize(self.data_path) - live * np.dtype(MASK_DTYPE).itemsize
+
+    def compact(self):
+        """Rewrite masks.bin with only the masks in the index, then flush.
+
+        Readers that mapped masks.bin before keep the old file, but a store
+        opened while this runs may pair the new index with the old data, so
+        do not compact while masks are being read.
+        """
+        if not self.writable:
+            raise IOError("mask store is opened read-only")
+        if not self.unreferenced_bytes():
+            return
+        source = np.memmap(self.data_path, dtype=MASK_DTYPE, mode="r")
+        tmp_path = self.data_path + ".tmp"
+        entries = {}
+        with open(tmp_path, "wb") as f:
+            for image_id, entry in sorted(self.entries.items()):
+                offset, height, width = entry[:3]
+                entries[image_id] = (f.tell(), *entry[1:])
+                f.write(source[offset : offset + height * width].tobytes())
+        del source
+        self._data = None
+        os.replace(tmp_path, self.data_path)
+        self.entries = entries
+        self._dirty = True
+        self.flush()
+
+    def import_masks(self, images, mask_folder, replace=False):
+        """Copy per-image mask files into the store.
+
+        images is an iterable of (image_path, image_id); images without a
+        mask file are skipped, as are masks already current in the store
+        unless replace is set. Returns the number of masks imported.
+        """
+        imported = 0
+        for image_path, image_id in images:
+            mask_path = existing_mask_path(mask_folder, image_path)
+            if mask_path is None:
+                continue
+            if not replace and self.is_current(image_id, mask_path):
+                continue
+            self.put(image_id, load_mask(mask_path), mask_path)
+            imported += 1
+        # put only appends, so once most of masks.bin is replaced masks
+        # (e.g. after repeated --replace runs) the file is rewritten
+        unreferenced = self.unreferenced_bytes()
+        if unreferenced and unreferenced > os.path.getsize(self.data_path) // 2:
+            self.compact()
+        else:
+            self.flush()
+        return imported
+
+
+if __name__ == "__main__":
+    from modules.database import LabelDatabase
+
+    parser = argparse.ArgumentParser(
+        description="Build or update the memory-mapped mask store of a workspace."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing the raw images"
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="re-import masks that are already in the store",
+    )
+    args = parser.parse_args()
+
+    db = LabelDatabase(os.path.join(args.workspace, "labels.db"))
+    store = MaskStore(MaskStore.default_folder(args.workspace), writable=True)
+    try:
+        imported = store.import_masks(
+            db.image_ids(),
+            os.path.join(args.workspace, "segmented_images", "masks"),
+            replace=args.replace,
+        )
+    finally:
+        store.close()
+        db.close()
+    print(f"Imported {imported} masks, {len(store)} masks in the store")
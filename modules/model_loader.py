@@ -0,0 +1,50 @@
+from PySide6.QtCore import QThread, Signal
+
+
+class ModelLoader(QThread):
+    """Import torch/transformers and build the segmentation model off the GUI thread."""
+
+    loaded = Signal(object)
+    failed = Signal(str)
+
+    # loaders whose window has closed, kept referenced until their thread ends
+    _detached = set()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._cancelled = False
+
+    def run(self):
+        try:
+            from modules.face_segementation import FaceSegmentation
+
+            segmenter = FaceSegmentation()
+        except Exception as e:
+            if not self._cancelled:
+                self.failed.emit(str(e))
+            return
+        if not self._cancelled:
+            self.loaded.emit(segmenter)
+
+    def detach(self):
+        """Drop the result and let the load finish without blocking the caller.
+
+        Building the model cannot be interrupted (it may be downloading the
+        weights), so the thread is unparented and kept alive until it ends.
+        """
+        self._cancelled = True
+        self.loaded.disconnect()
+        self.failed.disconnect()
+        self.setParent(None)
+        ModelLoader._detached.add(self)
+        # self lives on the GUI thread, so this runs there once the thread ends
+        self.finished.connect(self._forget)
+
+    def _forget(self):
+        ModelLoader._detached.discard(self)
+        self.deleteLater()
+
+    @classmethod
+    def detached_running(cls):
+        """True if a detached load is still running, see detach."""
+        return any(loader.isRunning() for loader in cls._detached)
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QSize, Qt
+from PySide6.QtGui import QImage
+
+from modules.image_cache import load_image
+
+
+# long edge of the stored renditions, smallest first
+PYRAMID_LEVELS = (512, 1024, 2048)
+
+
+def pyramid_levels(max_size=None):
+    """PYRAMID_LEVELS, plus the long edge of max_size if it is larger."""
+    if max_size is None:
+        return PYRAMID_LEVELS
+    long_edge = max(max_size.width(), max_size.height())
+    if long_edge > PYRAMID_LEVELS[-1]:
+        return PYRAMID_LEVELS + (long_edge,)
+    return PYRAMID_LEVELS
+
+
+# file in each image folder holding the path of its source image
+SOURCE_FILE = "source"
+
+
+class PyramidCache:
+    """Per-workspace on-disk cache of display-resolution image renditions.
+
+    Each source image gets one file per level, stored under a folder named
+    after its path and a file name carrying its mtime and size. A source that
+    changes on disk therefore misses the cache, and its stale renditions are
+    removed when the new ones are written. The folders of sources that no
+    longer exist are removed by prune and remove.
+    """
+
+    def __init__(self, cache_dir, levels=PYRAMID_LEVELS):
+        self.cache_dir = cache_dir
+        self.levels = tuple(sorted(levels))
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        # renditions are generated one at a time so they never compete with
+        # the display prefetch for more than one core
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pyramid-cache"
+        )
+
+    def load(self, image_path, max_size=None):
+        """Return the image scaled to fit max_size, from a rendition if possible.
+
+        A max_size larger than every level gets the largest rendition, which
+        the display scales up. Falls back to decoding the source, and
+        schedules its renditions to be generated in the background.
+        """
+        stamp = self._stamp(image_path)
+        if stamp is None:
+            return QImage()
+        if max_size is not None:
+            target = max(max_size.width(), max_size.height())
+            level = next(
+                (level for level in self.levels if level >= target), self.levels[-1]
+            )
+            rendition_path = self.rendition_path(image_path, stamp, level)
+            if os.path.exists(rendition_path):
+                return load_image(rendition_path, max_size)
+        self.schedule([image_path])
+        return load_image(image_path, max_size)
+
+    def rendition_path(self, image_path, stamp, level):
+        ext = ".jpg" if image_path.lower().endswith(".jpg") else ".png"
+        return os.path.join(
+            self._image_dir(image_path), f"{stamp[0]}-{stamp[1]}-{level}{ext}"
+        )
+
+    def schedule(self, image_paths):
+        """Generate the renditions of the given images in the background."""
+        with self._lock:
+            for image_path in image_paths:
+                if image_path in self._scheduled:
+                    continue
+                self._scheduled.add(image_path)
+                self._executor.submit(self._generate_scheduled, image_path)
+
+    def generate(self, image_path):
+        """Write every missing rendition of an image, decoding the source once."""
+        stamp = self._stamp(image_path)
+        if stamp is None:
+            return
+        missing = [
+            level
+            for level in self.levels
+            if not os.path.exists(self.rendition_path(image_path, stamp, level))
+        ]
+        if not missing:
+            return
+        self._remove_stale(image_path, stamp)
+        image_dir = self._image_dir(image_path)
+        if not os.path.isdir(image_dir):
+            os.makedirs(image_dir)
+            with open(os.path.join(image_dir, SOURCE_FILE), "w") as f:
+                f.write(os.path.abspath(image_path))
+
+        largest = max(missing)
+        image = load_image(image_path, QSize(largest, largest))
+        if image.isNull():
+            return
+        # build the levels from the largest down, each from the previous one
+        for level in sorted(missing, reverse=True):
+            if max(image.width(), image.height()) > level:
+                image = image.scaled(
+                    level,
+                    level,
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation,
+                )
+            rendition_path = self.rendition_path(image_path, stamp, level)
+            tmp_path = f"{rendition_path}.{threading.get_ident()}.tmp"
+            image_format = "JPG" if rendition_path.endswith(".jpg") else "PNG"
+            if image.save(tmp_path, image_format):
+                os.replace(tmp_path, rendition_path)
+
+    def remove(self, image_paths):
+        """Delete the renditions of the given images in the background."""
+        image_dirs = [self._image_dir(image_path) for image_path in image_paths]
+        self._executor.submit(_remove_folders, image_dirs)
+
+    def prune(self):
+        """Delete, in the background, the renditions of sources that are gone."""
+        self._executor.submit(self._prune)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _generate_scheduled(self, image_path):
+        try:
+            self.generate(image_path)
+        finally:
+            with self._lock:
+                self._scheduled.discard(image_path)
+
+    def _prune(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        stale = []
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for image_dir in os.scandir(folder.path):
+                try:
+                    with open(os.path.join(image_dir.path, SOURCE_FILE)) as f:
+                        source = f.read()
+                except OSError:
+                    # written before the source was recorded
+                    source = None
+                if source is None or not os.path.exists(source):
+                    stale.append(image_dir.path)
+        _remove_folders(stale)
+
+    def _image_dir(self, image_path):
+        digest = hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _stamp(self, image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _remove_stale(self, image_path, stamp):
+        image_dir = self._image_dir(image_path)
+        if not os.path.isdir(image_dir):
+            return
+        prefix = f"{stamp[0]}-{stamp[1]}-"
+        for name in os.listdir(image_dir):
+            if name != SOURCE_FILE and not name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(image_dir, name))
+                except OSError:
+                    pass
+
+
+def _remove_folders(folders):
+    for folder in folders:
+        shutil.rmtree(folder, ignore_errors=True)
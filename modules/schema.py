@@ -0,0 +1,304 @@
+import sqlite3
+
+# labels.db schema, upgraded in place by migrate(). Each migration runs once,
+# in its own transaction, and is recorded in the schema_version table, so a
+# database made by any earlier version of the tool ends up with the same
+# schema as a new one.
+
+
+def _create_base_tables(conn):
+    """The tables init_db has always created."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS labels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            label_name TEXT NOT NULL,
+            key_binding TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_path TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS image_labels (
+            image_id INTEGER,
+            label_id INTEGER,
+            PRIMARY KEY (image_id, label_id),
+            FOREIGN KEY (image_id) REFERENCES images(id),
+            FOREIGN KEY (label_id) REFERENCES labels(id)
+        )
+        """
+    )
+
+
+def _create_blob_tables(conn):
+    """Blob keypoints and parameter sweeps, see replace_blobs and blob_sweep.py."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blob_params (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            params TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY,
+            image_id INTEGER NOT NULL,
+            x REAL NOT NULL,
+            y REAL NOT NULL,
+            size REAL NOT NULL,
+            label TEXT NOT NULL,
+            params_id INTEGER,
+            FOREIGN KEY (image_id) REFERENCES images(id),
+            FOREIGN KEY (params_id) REFERENCES blob_params(id)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS blobs_image ON blobs (image_id, params_id)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS blobs_label_size ON blobs (label, size)")
+    # bounding box of each blob, kept in step with blobs by the triggers
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS blobs_rtree
+        USING rtree(id, min_x, max_x, min_y, max_y)
+        """
+    )
+    _create_blob_triggers(conn)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blob_sweeps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            search_space TEXT NOT NULL,
+            image_count INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blob_sweep_results (
+            sweep_id INTEGER NOT NULL,
+            params_id INTEGER NOT NULL,
+            blur_kernel INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            blob_count INTEGER NOT NULL,
+            PRIMARY KEY (sweep_id, params_id, blur_kernel, label),
+            FOREIGN KEY (sweep_id) REFERENCES blob_sweeps(id),
+            FOREIGN KEY (params_id) REFERENCES blob_params(id)
+        )
+        """
+    )
+
+
+def _create_blob_triggers(conn):
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS blobs_rtree_insert AFTER INSERT ON blobs
+        BEGIN
+            INSERT INTO blobs_rtree VALUES (
+                new.id,
+                new.x - new.size / 2, new.x + new.size / 2,
+                new.y - new.size / 2, new.y + new.size / 2
+            );
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS blobs_rtree_delete AFTER DELETE ON blobs
+        BEGIN
+            DELETE FROM blobs_rtree WHERE id = old.id;
+        END
+        """
+    )
+
+
+def _rebuild(conn, table, create_sql, columns, keep_where="1"):
+    """Replace a table by one created with create_sql, keeping the matching rows.
+
+    SQLite cannot alter the constraints of a table, so it is recreated under
+    a new name, the rows are copied and the new table takes the old name.
+    Foreign key enforcement must be off while this runs.
+    """
+    conn.execute(create_sql.format(table=f"{table}_new"))
+    conn.execute(
+        f"INSERT OR IGNORE INTO {table}_new ({columns}) "
+        f"SELECT {columns} FROM {table} WHERE {keep_where}"
+    )
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def _cascade_and_indexes(conn):
+    """Foreign keys with ON DELETE CASCADE, normalised key bindings, indexes.
+
+    Rows already pointing at deleted images, labels or sweeps are dropped
+    on the way.
+    """
+    # key bindings are matched upper-cased, the generated column is indexed
+    # so the lookup no longer scans labels
+    label_columns = [row[1] for row in conn.execute("PRAGMA table_xinfo(labels)")]
+    if "key_binding_upper" not in label_columns:
+        conn.execute(
+            """
+            ALTER TABLE labels ADD COLUMN key_binding_upper TEXT
+            GENERATED ALWAYS AS (upper(key_binding)) VIRTUAL
+            """
+        )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS labels_key_binding ON labels (key_binding_upper)"
+    )
+
+    # the primary key answers lookups by image, the label index the ones by
+    # label (remove_label, exports filtered by label); both cover the table
+    _rebuild(
+        conn,
+        "image_labels",
+        """
+        CREATE TABLE {table} (
+            image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+            label_id INTEGER NOT NULL REFERENCES labels(id) ON DELETE CASCADE,
+            PRIMARY KEY (image_id, label_id)
+        ) WITHOUT ROWID
+        """,
+        "image_id, label_id",
+        "image_id IN (SELECT id FROM images) AND label_id IN (SELECT id FROM labels)",
+    )
+    conn.execute("CREATE INDEX image_labels_label ON image_labels (label_id, image_id)")
+
+    # orphans are deleted through the old table so the trigger drops their
+    # R*Tree entries too; the ids are kept, so the R*Tree stays valid
+    conn.execute("DELETE FROM blobs WHERE image_id NOT IN (SELECT id FROM images)")
+    conn.execute(
+        """
+        UPDATE blobs SET params_id = NULL
+        WHERE params_id NOT IN (SELECT id FROM blob_params)
+        """
+    )
+    _rebuild(
+        conn,
+        "blobs",
+        """
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY,
+            image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+            x REAL NOT NULL,
+            y REAL NOT NULL,
+            size REAL NOT NULL,
+            label TEXT NOT NULL,
+            params_id INTEGER REFERENCES blob_params(id) ON DELETE CASCADE
+        )
+        """,
+        "id, image_id, x, y, size, label, params_id",
+    )
+    conn.execute("CREATE INDEX blobs_image ON blobs (image_id, params_id)")
+    conn.execute("CREATE INDEX blobs_label_size ON blobs (label, size)")
+    _create_blob_triggers(conn)
+
+    _rebuild(
+        conn,
+        "blob_sweep_results",
+        """
+        CREATE TABLE {table} (
+            sweep_id INTEGER NOT NULL REFERENCES blob_sweeps(id) ON DELETE CASCADE,
+            params_id INTEGER NOT NULL REFERENCES blob_params(id) ON DELETE CASCADE,
+            blur_kernel INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            blob_count INTEGER NOT NULL,
+            PRIMARY KEY (sweep_id, params_id, blur_kernel, label)
+        )
+        """,
+        "sweep_id, params_id, blur_kernel, label, blob_count",
+        "sweep_id IN (SELECT id FROM blob_sweeps) "
+        "AND params_id IN (SELECT id FROM blob_params)",
+    )
+
+
+# (version, description, function); append new migrations, never edit old ones
+MIGRATIONS = [
+    (1, "labels, images and image_labels", _create_base_tables),
+    (2, "blob keypoints and parameter sweeps", _create_blob_tables),
+    (3, "cascading foreign keys, key binding and label indexes", _cascade_and_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+# foreign keys are enforced from this version on; older databases may hold
+# orphaned rows until it has run
+FOREIGN_KEYS_VERSION = 3
+
+
+def schema_version(conn):
+    """Version of the database schema, 0 for a database without a version."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    return conn.execute(
+        "SELECT coalesce(max(version), 0) FROM schema_version"
+    ).fetchone()[0]
+
+
+def migrate(conn):
+    """Apply the pending migrations and turn foreign key enforcement on.
+
+    Returns the versions applied. A migration that fails is rolled back and
+    the error raised, leaving the database at the previous version.
+    """
+    # foreign keys cannot be switched inside a transaction, and must be off
+    # while tables are rebuilt
+    conn.execute("PRAGMA foreign_keys=OFF")
+    applied = []
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        # cheap check first, so an up to date database is never write-locked
+        if schema_version(conn) >= SCHEMA_VERSION:
+            return applied
+        for version, description, upgrade in MIGRATIONS:
+            # the write lock is taken before reading the version, so two
+            # processes opening the database at once apply each migration once
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= schema_version(conn):
+                    conn.rollback()
+                    continue
+                upgrade(conn)
+                if version >= FOREIGN_KEYS_VERSION:
+                    problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+                else:
+                    problems = []
+                if problems:
+                    raise sqlite3.IntegrityError(
+                        f"migration {version} left foreign key violations: "
+                        f"{problems[:5]}"
+                    )
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description),
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            applied.append(version)
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    return applied
@@ -0,0 +1,210 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+# torch, transformers and onnxruntime are imported inside the functions that
+# use them, like in face_segementation
+
+MODEL_NAME = "jonathandinu/face-parsing"
+BACKENDS = ("torch", "onnx")
+
+# the backend can be picked per machine without code changes, e.g.
+# FACE_SEGMENTATION_BACKEND=onnx FACE_SEGMENTATION_ONNX=models/face-parsing.int8.onnx
+BACKEND_ENV = "FACE_SEGMENTATION_BACKEND"
+ONNX_MODEL_ENV = "FACE_SEGMENTATION_ONNX"
+DEFAULT_ONNX_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "models",
+    "face-parsing.onnx",
+)
+
+
+class TorchBackend:
+    """Eager PyTorch Segformer, on the GPU when there is one unless device is set."""
+
+    name = "torch"
+
+    def __init__(self, model=None, device=None):
+        import torch
+        from transformers import SegformerForSemanticSegmentation
+
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = model or SegformerForSemanticSegmentation.from_pretrained(
+            MODEL_NAME
+        )
+        self.model.to(self.device)
+        self.model.eval()
+        # identifies the weights in cache keys, the hub commit when known
+        revision = getattr(self.model.config, "_commit_hash", None) or "local"
+        self.model_id = f"{MODEL_NAME}@{revision}"
+
+    def logits(self, pixel_values):
+        """Return the [N, C, h, w] logits of a [N, 3, H, W] pixel_values tensor."""
+        import torch
+
+        with torch.inference_mode():
+            return self.model(pixel_values=pixel_values.to(self.device)).logits
+
+
+class OnnxBackend:
+    """The exported model run by ONNX Runtime on the CPU."""
+
+    name = "onnx"
+
+    def __init__(self, onnx_path, threads=None):
+        import onnxruntime as ort
+
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(
+                f"ONNX model {onnx_path} not found, create it with "
+                "python -m modules.segmentation_backends export"
+            )
+        self.device = "cpu"
+        self.onnx_path = onnx_path
+        stat = os.stat(onnx_path)
+        self.model_id = (
+            f"onnx:{os.path.basename(onnx_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def logits(self, pixel_values):
+        """Return the [N, C, h, w] logits of a [N, 3, H, W] pixel_values tensor."""
+        import torch
+
+        inputs = pixel_values.cpu().numpy().astype(np.float32, copy=False)
+        (logits,) = self.session.run(None, {self.input_name: inputs})
+        return torch.from_numpy(logits)
+
+
+def create_backend(backend=None, onnx_path=None, device=None):
+    """Build a backend by name; unset arguments fall back to the environment.
+
+    device only applies to the torch backend, onnx always runs on the CPU.
+    """
+    backend = backend or os.environ.get(BACKEND_ENV, "torch")
+    if backend == "torch":
+        return TorchBackend(device=device)
+    if backend == "onnx":
+        return OnnxBackend(
+            onnx_path or os.environ.get(ONNX_MODEL_ENV, DEFAULT_ONNX_PATH)
+        )
+    raise ValueError(f"unknown segmentation backend {backend!r}")
+
+
+def quantized_path(onnx_path):
+    return os.path.splitext(onnx_path)[0] + ".int8.onnx"
+
+
+def export_onnx(onnx_path, model=None, image_size=512, opset=17):
+    """Export the face-parsing model to ONNX with a dynamic batch dimension."""
+    import torch
+    from transformers import SegformerForSemanticSegmentation
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).logits
+
+    model = model or SegformerForSemanticSegmentation.from_pretrained(MODEL_NAME)
+    model.eval()
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    torch.onnx.export(
+        LogitsOnly(model),
+        (dummy,),
+        onnx_path,
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    return onnx_path
+
+
+def quantize_onnx(onnx_path, output_path=None):
+    """Write a dynamic int8 quantized copy of an exported model."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_path = output_path or quantized_path(onnx_path)
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+    return output_path
+
+
+def check_parity(reference, candidate, pixel_values):
+    """Compare two backends on the same inputs.
+
+    Returns a dict with the largest absolute logit difference, the fraction
+    of logit pixels with the same argmax label and the seconds each backend
+    took.
+    """
+    start = time.perf_counter()
+    expected = reference.logits(pixel_values).cpu().float()
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = candidate.logits(pixel_values).cpu().float()
+    candidate_seconds = time.perf_counter() - start
+    return {
+        "max_abs_diff": float((expected - actual).abs().max()),
+        "label_agreement": float(
+            (expected.argmax(dim=1) == actual.argmax(dim=1)).float().mean()
+        ),
+        "reference_seconds": reference_seconds,
+        "candidate_seconds": candidate_seconds,
+    }
+
+
+def load_pixel_values(image_paths):
+    from PIL import Image
+    from transformers import SegformerImageProcessor
+
+    image_processor = SegformerImageProcessor.from_pretrained(MODEL_NAME)
+    images = [Image.open(path).convert("RGB") for path in image_paths]
+    return image_processor(images=images, return_tensors="pt")["pixel_values"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the face-parsing model to ONNX and check it against torch."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="export the model to ONNX")
+    export_parser.add_argument("--output", default=DEFAULT_ONNX_PATH)
+    export_parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="also write a dynamic int8 quantized .int8.onnx model",
+    )
+    check_parser = subparsers.add_parser(
+        "check", help="compare an ONNX model with torch on sample images"
+    )
+    check_parser.add_argument("images", nargs="+", help="sample images")
+    check_parser.add_argument("--onnx-model", default=DEFAULT_ONNX_PATH)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exported {export_onnx(args.output)}")
+        if args.quantize:
+            print(f"Quantized {quantize_onnx(args.output)}")
+    else:
+        result = check_parity(
+            TorchBackend(), OnnxBackend(args.onnx_model), load_pixel_values(args.images)
+        )
+        print(
+            f"max |logit diff| {result['max_abs_diff']:.4f}, "
+            f"label agreement {result['label_agreement']:.2%}, "
+            f"torch {result['reference_seconds']:.2f}s, "
+            f"onnx {result['candidate_seconds']:.2f}s"
+        )
@@ -0,0 +1,160 @@
+import collections
+import hashlib
+import os
+import shutil
+import threading
+
+
+# shared by every workspace on the machine, override with the environment
+CACHE_DIR_ENV = "LABELING_TOOL_SEGMENTATION_CACHE"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "labeling_tool", "segmentation"
+)
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# file name suffix of each cached output
+OUTPUT_SUFFIXES = ("_segmented.png", "_mask.png")
+# empty file per entry whose mtime records its last use; the outputs
+# themselves are hard linked into workspaces, which key other caches on
+# their mtime, so their times are never touched
+USED_SUFFIX = ".used"
+
+
+class SegmentationCache:
+    """Content-addressed cache of segmentation outputs shared across workspaces.
+
+    An entry is keyed by the sha256 of the image bytes and the model key, so
+    a photo copied into another workspace, or renamed, is never segmented
+    twice by the same model. Entries are hard linked into a workspace when
+    possible (copied otherwise) and evicted least recently used first once
+    the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> bytes, oldest first
+        self._total_bytes = 0
+        self._load()
+
+    @staticmethod
+    def key(image_path, model_key):
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digest.update(b"\0" + model_key.encode("utf-8"))
+        return digest.hexdigest()
+
+    def fetch(self, key, output_path, output_mask_path):
+        """Place a cached result at the output paths; returns False on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._entries.move_to_end(key)
+        cached_paths = self._entry_paths(key)
+        try:
+            for cached_path, path in zip(cached_paths, (output_path, output_mask_path)):
+                if path:
+                    _link_or_copy(cached_path, path)
+            # recency across sessions, see USED_SUFFIX
+            _touch(self._used_path(key))
+        except OSError:
+            # removed behind our back, e.g. by another process evicting it
+            self._forget(key)
+            return False
+        return True
+
+    def store(self, key, output_path, output_mask_path):
+        """Add the outputs of a finished segmentation to the cache."""
+        if not (output_path and output_mask_path) or key in self._entries:
+            return
+        cached_paths = self._entry_paths(key)
+        os.makedirs(os.path.dirname(cached_paths[0]), exist_ok=True)
+        size = 0
+        for path, cached_path in zip((output_path, output_mask_path), cached_paths):
+            tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, cached_path)
+            size += os.path.getsize(cached_path)
+        _touch(self._used_path(key))
+        with self._lock:
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry_paths(self, key):
+        folder = os.path.join(self.cache_dir, key[:2])
+        return [os.path.join(folder, key + suffix) for suffix in OUTPUT_SUFFIXES]
+
+    def _used_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + USED_SUFFIX)
+
+    def _load(self):
+        """Rebuild the LRU order from the files of earlier sessions."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = {}  # key -> [bytes, last use]
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(USED_SUFFIX):
+                    key = entry.name[: -len(USED_SUFFIX)]
+                    entries.setdefault(key, [0, 0])[1] = entry.stat().st_mtime_ns
+                    continue
+                suffix = next(
+                    (s for s in OUTPUT_SUFFIXES if entry.name.endswith(s)), None
+                )
+                if suffix is None:
+                    continue
+                stat = entry.stat()
+                size_and_time = entries.setdefault(entry.name[: -len(suffix)], [0, 0])
+                size_and_time[0] += stat.st_size
+                # entries of earlier versions have no .used file yet
+                size_and_time[1] = max(size_and_time[1], stat.st_mtime_ns)
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if all(os.path.exists(path) for path in self._entry_paths(key)):
+                self._entries[key] = size
+                self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            for path in self._entry_paths(key) + [self._used_path(key)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _forget(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+
+
+def _touch(path):
+    with open(path, "a"):
+        pass
+    os.utime(path)
+
+
+def _link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        # different file system, or links not supported
+        shutil.copyfile(source, destination)
@@ -0,0 +1,222 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# setting LABELING_TOOL_TRACE to a folder turns tracing on in the GUI and the
+# tools that call enable_from_env; they write their report there on exit
+TRACE_ENV = "LABELING_TOOL_TRACE"
+# durations kept per span name for the percentiles, and trace events kept
+MAX_SAMPLES = 10000
+MAX_EVENTS = 200000
+
+
+class MetricsRegistry:
+    """Durations of named spans, shared by every thread of the process.
+
+    Counts and totals cover every span; percentiles are taken over the last
+    MAX_SAMPLES durations of each name and the Chrome trace keeps the last
+    MAX_EVENTS spans, so a long session does not grow without bound.
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES, max_events=MAX_EVENTS):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.totals = {}
+        self.samples = {}
+        self.events = deque(maxlen=max_events)
+        # trace timestamps are relative to the registry creation
+        self.origin = time.perf_counter()
+
+    def record(self, name, start, seconds, args=None):
+        event = (name, start, seconds, threading.get_ident(), args)
+        with self.lock:
+            if name not in self.counts:
+                self.counts[name] = 0
+                self.totals[name] = 0.0
+                self.samples[name] = deque(maxlen=self.max_samples)
+            self.counts[name] += 1
+            self.totals[name] += seconds
+            self.samples[name].append(seconds)
+            self.events.append(event)
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+            self.totals.clear()
+            self.samples.clear()
+            self.events.clear()
+
+    def summary(self):
+        """{span name: count, total, mean and p50/p95/p99/max in ms}."""
+        with self.lock:
+            items = [
+                (name, self.counts[name], self.totals[name], list(self.samples[name]))
+                for name in sorted(self.counts)
+            ]
+        summary = {}
+        for name, count, total, samples in items:
+            ms = np.array(samples) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[name] = {
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_ms": total * 1000 / count,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(ms.max()),
+            }
+        return summary
+
+    def dump_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def export_chrome_trace(self, path):
+        """Write the spans as complete events for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        trace_events = []
+        for name, start, seconds, tid, args in events:
+            event = {
+                "name": name,
+                "cat": name.split(".", 1)[0],
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": seconds * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+registry = MetricsRegistry()
+_enabled = False
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.record(
+            self.name, self.start, time.perf_counter() - self.start, self.args
+        )
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# returned by every span() while tracing is off, nothing is allocated or timed
+_NO_SPAN = _NoSpan()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def span(name, **args):
+    """Context manager timing a block as the span name.
+
+    args are shown on the event in the Chrome trace, e.g. the image path.
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, args or None)
+
+
+def traced(name):
+    """Decorator timing every call of a function as the span name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.record(name, start, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_folder():
+    return os.environ.get(TRACE_ENV) or None
+
+
+def enable_from_env():
+    """Enable tracing if LABELING_TOOL_TRACE is set; returns the folder."""
+    folder = trace_folder()
+    if folder:
+        enable()
+    return folder
+
+
+def write_report(folder, prefix="trace"):
+    """Write the span summary and the Chrome trace to timestamped files.
+
+    Returns (metrics path, trace path).
+    """
+    os.makedirs(folder, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    metrics_path = os.path.join(folder, f"{prefix}-{stamp}-metrics.json")
+    trace_path = os.path.join(folder, f"{prefix}-{stamp}-chrome.json")
+    registry.dump_json(metrics_path)
+    registry.export_chrome_trace(trace_path)
+    return metrics_path, trace_path
+
+
+def print_summary(summary=None):
+    summary = registry.summary() if summary is None else summary
+    for name, stats in summary.items():
+        print(
+            f"{name:36} n={stats['count']:<6} p50 {stats['p50_ms']:9.2f} ms  "
+            f"p95 {stats['p95_ms']:9.2f} ms  p99 {stats['p99_ms']:9.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Print the span summary of a metrics file written by tracing."
+    )
+    parser.add_argument("metrics", help="a *-metrics.json file")
+    args = parser.parse_args()
+    with open(args.metrics) as f:
+        print_summary(json.load(f))
@@ -0,0 +1,82 @@
+import os
+import glob
+from natsort import natsorted
+
+
+SEGMENTED_IMAGE_SUFFIX = "_segmented.png"
+# masks are stored as 8-bit PNG, older workspaces have int64 .npy masks
+MASK_SUFFIX = "_mask.png"
+LEGACY_MASK_SUFFIX = "_mask.npy"
+BLOB_IMAGE_SUFFIX = "_blobs.png"
+KEYPOINTS_SUFFIX = "_keypoints.json"
+
+
+def get_image_paths(directory):
+    """Return all jpg/png images in a directory, sorted in natural order.
+
+    The paths are absolute, as stored in labels.db, whatever the working
+    directory the tool runs from.
+    """
+    directory = os.path.abspath(directory)
+    return natsorted(
+        glob.glob(os.path.join(directory, "*.jpg"))
+        + glob.glob(os.path.join(directory, "*.png"))
+    )
+
+
+def iter_image_paths(directory):
+    """Yield the jpg/png images of a directory unsorted, without building a list."""
+    # entry.path is joined onto the directory, so absolute like get_image_paths
+    with os.scandir(os.path.abspath(directory)) as it:
+        for entry in it:
+            if entry.name.endswith((".jpg", ".png")) and entry.is_file():
+                yield entry.path
+
+
+def image_stem(image_path):
+    """Base name used to match a raw image with its derived outputs."""
+    return os.path.basename(image_path).split(".")[0]
+
+
+def segmentation_folders(workspace_path):
+    """Return (segmented image folder, mask folder), creating them if needed."""
+    seg_folder = os.path.join(workspace_path, "segmented_images")
+    mask_folder = os.path.join(seg_folder, "masks")
+    os.makedirs(mask_folder, exist_ok=True)
+    return seg_folder, mask_folder
+
+
+def blob_folders(workspace_path):
+    """Return (blob image folder, keypoints folder), creating them if needed."""
+    blob_folder = os.path.join(workspace_path, "blob_images")
+    keypoints_folder = os.path.join(blob_folder, "keypoints")
+    os.makedirs(keypoints_folder, exist_ok=True)
+    return blob_folder, keypoints_folder
+
+
+def segmentation_output_paths(seg_folder, mask_folder, image_path):
+    """Return (segmented image path, mask path) for a raw image."""
+    stem = image_stem(image_path)
+    return (
+        os.path.join(seg_folder, stem + SEGMENTED_IMAGE_SUFFIX),
+        os.path.join(mask_folder, stem + MASK_SUFFIX),
+    )
+
+
+def existing_mask_path(mask_folder, image_path):
+    """Return the mask of an image in either format, or None if there is none."""
+    stem = image_stem(image_path)
+    for suffix in (MASK_SUFFIX, LEGACY_MASK_SUFFIX):
+        mask_path = os.path.join(mask_folder, stem + suffix)
+        if os.path.exists(mask_path):
+            return mask_path
+    return None
+
+
+def blob_output_paths(blob_folder, keypoints_folder, image_path):
+    """Return (blob image path, keypoints json path) for a raw image."""
+    stem = image_stem(image_path)
+    return (
+        os.path.join(blob_folder, stem + BLOB_IMAGE_SUFFIX),
+        os.path.join(keypoints_folder, stem + KEYPOINTS_SUFFIX),
+    )
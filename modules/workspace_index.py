@@ -0,0 +1,125 @@
+import bisect
+import os
+from natsort import natsort_keygen, natsorted
+
+from PySide6.QtCore import QFileSystemWatcher, QObject, QTimer, Signal
+
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+MASK_EXTENSIONS = (".png", ".npy")
+
+# coalesce bursts of file system events before rescanning a folder
+RESCAN_DELAY_MS = 500
+
+
+class WorkspaceIndex(QObject):
+    """Incremental index of the raw images and derived outputs of a workspace.
+
+    Every folder is listed once when the index is built. Outputs written by
+    the app are added with add() in O(1), and external changes reported by a
+    QFileSystemWatcher trigger a debounced rescan of only the changed folder.
+
+    The watcher also reports the app's own writes. add() records the folder
+    mtime after each one, and a folder whose mtime has not moved since is
+    not rescanned. A batch of segment or blob jobs therefore causes no
+    rescans. An external change landing between a job writing its file and
+    add() is picked up by the next external change.
+    """
+
+    # kind ("raw", "segmented", "mask" or "blob"), added paths, removed paths
+    changed = Signal(str, list, list)
+
+    def __init__(self, workspace_path, seg_image_folder, seg_mask_folder, blob_folder):
+        super().__init__()
+        self.folders = {
+            "raw": workspace_path,
+            "segmented": seg_image_folder,
+            "mask": seg_mask_folder,
+            "blob": blob_folder,
+        }
+        self.extensions = {
+            "raw": IMAGE_EXTENSIONS,
+            "segmented": IMAGE_EXTENSIONS,
+            "mask": MASK_EXTENSIONS,
+            "blob": IMAGE_EXTENSIONS,
+        }
+        # folder mtime (ns) the entries are known to be up to date with
+        self._mtimes = {}
+        self.entries = {kind: self._scan(kind) for kind in self.folders}
+
+        self._dirty = set()
+        self._rescan_timer = QTimer(self)
+        self._rescan_timer.setSingleShot(True)
+        self._rescan_timer.setInterval(RESCAN_DELAY_MS)
+        self._rescan_timer.timeout.connect(self._rescan_dirty)
+        self.watcher = QFileSystemWatcher(list(self.folders.values()), self)
+        self.watcher.directoryChanged.connect(self._on_directory_changed)
+
+    def image_paths(self):
+        """Return the raw image paths in natural order."""
+        return natsorted(self.path(name) for name in self.entries["raw"])
+
+    def path(self, name, kind="raw"):
+        return os.path.join(self.folders[kind], name)
+
+    def has(self, kind, path):
+        return os.path.basename(path) in self.entries[kind]
+
+    def count(self, kind):
+        return len(self.entries[kind])
+
+    def add(self, kind, path):
+        """Record an output the app has just written."""
+        self.entries[kind].add(os.path.basename(path))
+        self._mtimes[kind] = self._folder_mtime(kind)
+
+    def _folder_mtime(self, kind):
+        try:
+            return os.stat(self.folders[kind]).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan(self, kind):
+        folder = self.folders[kind]
+        # taken before listing, so a change during the scan is rescanned
+        self._mtimes[kind] = self._folder_mtime(kind)
+        if not os.path.isdir(folder):
+            return set()
+        extensions = self.extensions[kind]
+        with os.scandir(folder) as it:
+            return {
+                entry.name
+                for entry in it
+                if entry.name.endswith(extensions) and entry.is_file()
+            }
+
+    def _on_directory_changed(self, folder):
+        for kind, kind_folder in self.folders.items():
+            if kind_folder == folder:
+                self._dirty.add(kind)
+        self._rescan_timer.start()
+
+    def _rescan_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        for kind in dirty:
+            mtime = self._folder_mtime(kind)
+            if mtime is not None and mtime == self._mtimes.get(kind):
+                # only the app's own writes, already recorded by add()
+                continue
+            entries = self._scan(kind)
+            added = entries - self.entries[kind]
+            removed = self.entries[kind] - entries
+            self.entries[kind] = entries
+            if added or removed:
+                self.changed.emit(
+                    kind,
+                    [self.path(name, kind) for name in added],
+                    [self.path(name, kind) for name in removed],
+                )
+
+
+def insert_sorted(image_paths, new_paths):
+    """Insert paths into a naturally sorted list, keeping it sorted."""
+    key = natsort_keygen()
+    for path in new_paths:
+        bisect.insort(image_paths, path, key=key)
@@ -0,0 +1,222 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from modules.face_segementation import (
+    DEFAULT_TILE_ROWS,
+    UPSAMPLE_MODES,
+    FaceSegmentation,
+)
+from modules.segmentation_backends import BACKENDS
+from modules.tracing import (
+    enable,
+    print_summary,
+    span,
+    trace_folder,
+    write_report,
+)
+from modules.workspace import (
+    existing_mask_path,
+    get_image_paths,
+    segmentation_folders,
+    segmentation_output_paths,
+)
+
+
+def pending_images(workspace_path, seg_folder, mask_folder):
+    """Yield (image, segmented image, mask) paths whose outputs are missing."""
+    for image_path in get_image_paths(workspace_path):
+        seg_image_path, seg_mask_path = segmentation_output_paths(
+            seg_folder, mask_folder, image_path
+        )
+        if os.path.exists(seg_image_path) and existing_mask_path(
+            mask_folder, image_path
+        ):
+            continue
+        yield image_path, seg_image_path, seg_mask_path
+
+
+def batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_batch(batch):
+    """Decode a batch; returns (decoded items, their images, failed count).
+
+    An image that cannot be decoded is reported and left out, so a rerun,
+    which resumes at the images without outputs, does not stop at it again.
+    """
+    items = []
+    images = []
+    with span("segment.decode", images=len(batch)):
+        for item in batch:
+            try:
+                images.append(Image.open(item[0]).convert("RGB"))
+            except Exception as e:
+                print(f"Skipping {item[0]}: {e}", flush=True)
+                continue
+            items.append(item)
+    return items, images, len(batch) - len(items)
+
+
+def peak_rss_bytes():
+    """High-water mark of this process's resident memory, None where unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def report_memory(segmenter):
+    print(
+        f"Peak upsample tensors: {segmenter.peak_upsample_bytes / 1e6:.1f} MB "
+        f"({segmenter.upsample_mode})"
+    )
+    peak_rss = peak_rss_bytes()
+    if peak_rss is not None:
+        print(f"Peak process memory: {peak_rss / 1e6:.1f} MB")
+    if segmenter.device == "cuda":
+        import torch
+
+        print(f"Peak GPU memory: {torch.cuda.max_memory_allocated() / 1e6:.1f} MB")
+
+
+def segment_workspace(workspace_path, batch_size=8, segmenter=None):
+    """Segment every image in a workspace that has no outputs yet."""
+    seg_folder, mask_folder = segmentation_folders(workspace_path)
+    segmenter = segmenter or FaceSegmentation()
+
+    processed = 0
+    reused = 0
+    failed = 0
+    start = time.perf_counter()
+
+    def uncached(pending):
+        # results of the same photo in another workspace are linked, not recomputed
+        nonlocal reused
+        for paths in pending:
+            if segmenter.reuse_cached(*paths):
+                reused += 1
+            else:
+                yield paths
+
+    batches = batched(
+        uncached(pending_images(workspace_path, seg_folder, mask_folder)), batch_size
+    )
+
+    # decode the next batch on a worker thread while the model runs on the current one
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        batch = next(batches, None)
+        future = loader.submit(load_batch, batch) if batch else None
+        while batch:
+            decoded, images, batch_failed = future.result()
+            failed += batch_failed
+            next_batch = next(batches, None)
+            if next_batch:
+                future = loader.submit(load_batch, next_batch)
+
+            if decoded:
+                segmenter.segment_images(
+                    images,
+                    [seg_image_path for _, seg_image_path, _ in decoded],
+                    [seg_mask_path for _, _, seg_mask_path in decoded],
+                    [image_path for image_path, _, _ in decoded],
+                )
+                processed += len(decoded)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"Segmented {processed} images "
+                    f"({processed / elapsed:.2f} images/s)",
+                    flush=True,
+                )
+            batch = next_batch
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {processed} images in {elapsed:.1f}s ({rate:.2f} images/s)")
+    if reused:
+        print(f"Reused {reused} cached segmentations")
+    if failed:
+        print(f"Skipped {failed} images that could not be decoded")
+    report_memory(segmenter)
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Segment all images of a workspace without the GUI."
+    )
+    parser.add_argument(
+        "workspace", type=os.path.abspath, help="directory containing the raw images"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="images per forward pass"
+    )
+    parser.add_argument(
+        "--upsample",
+        choices=UPSAMPLE_MODES,
+        default="full",
+        help="full: exact, most memory; tiled: exact, bounded memory; "
+        "nearest: argmax before upsampling, least memory",
+    )
+    parser.add_argument(
+        "--tile-rows",
+        type=int,
+        default=DEFAULT_TILE_ROWS,
+        help="output rows per band in tiled mode",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help="inference backend (default: $FACE_SEGMENTATION_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--onnx-model",
+        help="ONNX model for the onnx backend "
+        "(default: $FACE_SEGMENTATION_ONNX or models/face-parsing.onnx)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run the model, ignoring the shared segmentation cache",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FOLDER",
+        default=trace_folder(),
+        help="time each segmentation stage and write the span metrics and a "
+        "Chrome trace to FOLDER (default: $LABELING_TOOL_TRACE)",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        enable()
+    segmenter = FaceSegmentation(
+        upsample_mode=args.upsample,
+        tile_rows=args.tile_rows,
+        backend=args.backend,
+        onnx_path=args.onnx_model,
+        cache=False if args.no_cache else None,
+    )
+    segment_workspace(args.workspace, batch_size=args.batch_size, segmenter=segmenter)
+    if args.trace:
+        print_summary()
+        metrics_path, trace_path = write_report(args.trace, "segment")
+        print(f"Span metrics written to {metrics_path}, Chrome trace to {trace_path}")
+
+
+if __name__ == "__main__":
+    main()
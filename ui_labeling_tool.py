@@ -36,6 +36,16 @@ class Ui_MainWindow(object):
         self.actionParse_Current_Image.setObjectName(u"actionParse_Current_Image")
         self.actionUpdate_Database = QAction(MainWindow)
         self.actionUpdate_Database.setObjectName(u"actionUpdate_Database")
+        self.actionBlob_Detector_On_Workspace = QAction(MainWindow)
+        self.actionBlob_Detector_On_Workspace.setObjectName(u"actionBlob_Detector_On_Workspace")
+        self.actionCancel_Pending_Jobs = QAction(MainWindow)
+        self.actionCancel_Pending_Jobs.setObjectName(u"actionCancel_Pending_Jobs")
+        self.actionExport_Labels = QAction(MainWindow)
+        self.actionExport_Labels.setObjectName(u"actionExport_Labels")
+        self.actionBulk_Label_Images = QAction(MainWindow)
+        self.actionBulk_Label_Images.setObjectName(u"actionBulk_Label_Images")
+        self.actionThumbnail_View = QAction(MainWindow)
+        self.actionThumbnail_View.setObjectName(u"actionThumbnail_View")
         self.centralwidget = QWidget(MainWindow)
         self.centralwidget.setObjectName(u"centralwidget")
         self.imageTab = QTabWidget(self.centralwidget)
@@ -156,6 +166,8 @@ class Ui_MainWindow(object):
         self.menuFile.setObjectName(u"menuFile")
         self.menuDatabase = QMenu(self.menubar)
         self.menuDatabase.setObjectName(u"menuDatabase")
+        self.menuLabels = QMenu(self.menubar)
+        self.menuLabels.setObjectName(u"menuLabels")
         self.menuTools = QMenu(self.menubar)
         self.menuTools.setObjectName(u"menuTools")
         self.menuBlob_Detector = QMenu(self.menuTools)
@@ -169,13 +181,19 @@ class Ui_MainWindow(object):
 
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuDatabase.menuAction())
+        self.menubar.addAction(self.menuLabels.menuAction())
         self.menubar.addAction(self.menuTools.menuAction())
         self.menuFile.addAction(self.actionOpen_Workspace)
         self.menuDatabase.addAction(self.actionCreate_New_Database)
         self.menuDatabase.addAction(self.actionUpdate_Database)
+        self.menuDatabase.addAction(self.actionExport_Labels)
+        self.menuLabels.addAction(self.actionBulk_Label_Images)
+        self.menuLabels.addAction(self.actionThumbnail_View)
         self.menuTools.addAction(self.menuFace_Parsing_Tool.menuAction())
         self.menuTools.addAction(self.menuBlob_Detector.menuAction())
+        self.menuTools.addAction(self.actionCancel_Pending_Jobs)
         self.menuBlob_Detector.addAction(self.actionBlob_Detector_With_Face_Parsing)
+        self.menuBlob_Detector.addAction(self.actionBlob_Detector_On_Workspace)
         self.menuFace_Parsing_Tool.addAction(self.actionParse_Current_Image)
 
         self.retranslateUi(MainWindow)
@@ -193,6 +211,11 @@ class Ui_MainWindow(object):
         self.actionBlob_Detector_With_Face_Parsing.setText(QCoreApplication.translate("MainWindow", u"Blob Detector With Face Parsing", None))
         self.actionParse_Current_Image.setText(QCoreApplication.translate("MainWindow", u"Parse Current Image", None))
         self.actionUpdate_Database.setText(QCoreApplication.translate("MainWindow", u"Update Database", None))
+        self.actionBlob_Detector_On_Workspace.setText(QCoreApplication.translate("MainWindow", u"Blob Detector On Workspace", None))
+        self.actionCancel_Pending_Jobs.setText(QCoreApplication.translate("MainWindow", u"Cancel Pending Jobs", None))
+        self.actionExport_Labels.setText(QCoreApplication.translate("MainWindow", u"Export Labels...", None))
+        self.actionBulk_Label_Images.setText(QCoreApplication.translate("MainWindow", u"Bulk Label Images...", None))
+        self.actionThumbnail_View.setText(QCoreApplication.translate("MainWindow", u"Thumbnail View", None))
         self.imageLabelTabRaw.setText("")
         self.imageTab.setTabText(self.imageTab.indexOf(self.imageRawTab), QCoreApplication.translate("MainWindow", u"Raw", None))
         self.imageLabelTabSeg.setText("")
@@ -216,6 +239,7 @@ class Ui_MainWindow(object):
         self.focusStatus.setText(QCoreApplication.translate("MainWindow", u"OFF", None))
         self.menuFile.setTitle(QCoreApplication.translate("MainWindow", u"File", None))
         self.menuDatabase.setTitle(QCoreApplication.translate("MainWindow", u"Database", None))
+        self.menuLabels.setTitle(QCoreApplication.translate("MainWindow", u"Labels", None))
         self.menuTools.setTitle(QCoreApplication.translate("MainWindow", u"Tools", None))
         self.menuBlob_Detector.setTitle(QCoreApplication.translate("MainWindow", u"Blob Detector", None))
         self.menuFace_Parsing_Tool.setTitle(QCoreApplication.translate("MainWindow", u"Face Parsing Tool", None))